@@ -2,74 +2,47 @@
 import streamlit as st
 import pandas as pd
 import random
-import re
-from google_api_helpers import geocode_zip, search_places, get_place_details, get_place_photos, analyze_image_labels, get_photo_url
-from scorer import calculate_score
+import threading
+import time
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import api_cache
+import instrumentation
+from account_index import AccountIndex, load_account_index
+from search_planner import plan_search, plan_summary, METRO_RADIUS_M, ZIP_RADIUS_M, ALL_ZIPS_RADIUS_M
+from image_store import SessionImageStore
+from local_store import file_signature
+from pipeline import run_search, result_to_record, RunOptions, DEFAULT_CONCURRENCY, MAX_PAGES
+from scorer import rescore
+from zip_centroids import load_zip_codes
 
-# --- MODIFIED: Helper function to load accounts for advanced matching ---
-@st.cache_data
-def load_existing_accounts(filename="accounts.csv"):
-    """Loads account data and creates two lookup dictionaries for matching."""
-    place_id_map = {}
-    address_zip_map = {}
+# --- Helper function to load accounts for advanced matching ---
+# The index is shared across sessions; the signature argument makes it reload when accounts.csv changes
+@st.cache_resource
+def load_existing_accounts(filename="accounts.csv", signature=None):
+    """Loads the compiled account index used to tag places as Customer, Lead, Prospect or New."""
     try:
-        df = pd.read_csv(filename, dtype={'zipcode': str}) # Read zipcode as string
-        # Create a map for place_id -> sap_account_type
-        if "place_id" in df.columns and "sap_account_type" in df.columns:
-            id_df = df.dropna(subset=['place_id', 'sap_account_type'])
-            place_id_map = dict(zip(id_df['place_id'], id_df['sap_account_type']))
-
-        # Create a map for (first 6 of address, zipcode) -> sap_account_type
-        if "addr" in df.columns and "zipcode" in df.columns and "sap_account_type" in df.columns:
-            addr_df = df.dropna(subset=['addr', 'zipcode', 'sap_account_type'])
-            for index, row in addr_df.iterrows():
-                # Standardize the address key: lowercase, first 6 chars
-                addr_key = str(row['addr']).lower().strip()[:6]
-                zip_key = str(row['zipcode']).strip()
-                address_zip_map[(addr_key, zip_key)] = row['sap_account_type']
-                
-    except FileNotFoundError:
-        pass # It's okay if the file doesn't exist
+        return load_account_index(filename)
     except Exception as e:
         st.error(f"Error loading {filename}: {e}")
+        return AccountIndex()
 
-    return place_id_map, address_zip_map
-    
-# --- NEW: Helper function for the new matching logic ---
-def get_account_status(details, place_id_map, address_zip_map):
-    """Checks for a match by place_id first, then by address + zip."""
-    place_id = details.get('place_id')
 
-    # Method 1: Check for a direct place_id match
-    if place_id and place_id in place_id_map:
-        return place_id_map[place_id]
+def accounts_signature(filename="accounts.csv"):
+    try:
+        return file_signature(filename)
+    except FileNotFoundError:
+        return None
+    
+# Merges overlapping areas into a near-minimal set of search circles
+@st.cache_data(ttl=600)
+def plan_search_areas(search_areas, search_radius):
+    return plan_search(search_areas, search_radius)
 
-    # Method 2: Check by address and zip code
-    address = details.get('formatted_address', '')
-    if address:
-        # Standardize the address from Google for lookup
-        addr_lower = address.lower()
-        addr_key = addr_lower.strip()[:6]
-        
-        # Extract 5-digit zip code from the formatted address
-        zip_match = re.search(r'\b\d{5}\b', address)
-        if zip_match:
-            zip_key = zip_match.group(0)
-            if (addr_key, zip_key) in address_zip_map:
-                return address_zip_map[(addr_key, zip_key)]
 
-    # If no match is found by either method
-    return "New"
-        
-        
  # Helper function to load zip codes for the dropdown
 @st.cache_data
 def load_zip_list(filename="zips.csv"):
-    try:
-        df = pd.read_csv(filename)
-        return sorted(df['zipcode'].astype(str).tolist())
-    except FileNotFoundError:
-        return []
+    return load_zip_codes(filename)
 
 
 # --- Data for Metro Area Dropdown ---
@@ -122,14 +95,9 @@ if not check_password():
     st.stop()
     
     
-existing_accounts = load_existing_accounts()
-# --- THIS IS THE CORRECTED LINE THAT DEFINES THE MISSING VARIABLES ---
-place_id_accounts, address_accounts = load_existing_accounts()
+account_index = load_existing_accounts("accounts.csv", accounts_signature("accounts.csv"))
 ALL_ZIPS = load_zip_list()
 
-# --- NEW: Load existing accounts at the start ---
-existing_accounts = load_existing_accounts()
-
 # Display logo and title
 col1, col2 = st.columns([0.1, 0.9])
 with col1:
@@ -143,6 +111,9 @@ API_KEY = st.secrets["GOOGLE_API_KEY"]
 with st.sidebar:
     st.header("Search Settings")
     max_locations = st.number_input("Max number of locations to find:", min_value=1, max_value=10000, value=50, step=1)
+    concurrency = st.number_input("Concurrent requests per stage:", min_value=1, max_value=32, value=DEFAULT_CONCURRENCY, step=1)
+    max_pages = st.number_input("Result pages per area (20 places each):", min_value=1, max_value=MAX_PAGES, value=MAX_PAGES, step=1,
+                                help="Later pages are only fetched while an area keeps turning up new leads.")
     st.markdown("---")
     
     search_mode = st.radio("Choose Search Method:", ("Search All Zips", "Search by Metro Area", "Search by Specific Zip Code(s)"))
@@ -153,94 +124,157 @@ with st.sidebar:
     elif search_mode == "Search by Specific Zip Code(s)":
         if ALL_ZIPS: selected_zips = st.multiselect("Select Zip Codes:", options=ALL_ZIPS)
         else: st.warning("`zips.csv` not found or is empty.")
+
+    search_areas, search_radius, search_type = [], 0, ""
+    if search_mode == "Search by Metro Area":
+        search_areas, search_radius, search_type = selected_metros, METRO_RADIUS_M, "Metro Area"
+    elif search_mode == "Search by Specific Zip Code(s)":
+        search_areas, search_radius, search_type = selected_zips, ZIP_RADIUS_M, "Zip Code"
+    else:
+        search_areas, search_radius, search_type = ALL_ZIPS, ALL_ZIPS_RADIUS_M, "Zip Code"
+    search_plan = plan_search_areas(tuple(search_areas), search_radius) if search_areas else []
+    if search_plan:
+        plan_stats = plan_summary(search_plan)
+        st.caption(
+            f"Coverage plan: up to {plan_stats['searches']} searches for {plan_stats['areas']} areas"
+            + (f" ({plan_stats['geocodes']} need geocoding)" if plan_stats['geocodes'] else "")
+        )
     
     st.markdown("---")
     # --- NEW: Filter to exclude account types ---
     st.header("Filter Results")
     exclude_types = st.multiselect("Exclude Account Types:", options=["Customer", "Lead", "Prospect"])
+    # The lead ledger remembers every lead any session has found
+    use_ledger = st.checkbox("Reuse leads scored in earlier searches", value=True,
+                             help="Places scored recently are shown again without any Google or Vision calls.")
+    skip_seen_days = st.number_input("Hide places already found in the last N days (0 = show all):",
+                                     min_value=0, max_value=365, value=0, step=1, disabled=not use_ledger)
+
+    cache_stats = api_cache.stats()
+    if cache_stats:
+        st.markdown("---")
+        st.caption("API cache hits: " + ", ".join(
+            f"{endpoint} {counts['hits']}/{counts['hits'] + counts['misses']}" for endpoint, counts in sorted(cache_stats.items())
+        ))
+
+    # Calls, latency, bytes and estimated spend of the last search, per API endpoint and pipeline stage
+    run_metrics = st.session_state.get("run_metrics")
+    if run_metrics:
+        with st.expander("Last run metrics"):
+            st.caption(f"Took {run_metrics['elapsed_seconds']:.1f}s; "
+                       f"estimated API cost ${sum(instrumentation.estimated_cost(run_metrics).values()):.2f}")
+            st.dataframe(pd.DataFrame(instrumentation.summary_rows(run_metrics)), hide_index=True)
+            st.download_button("Export JSON", instrumentation.to_json(run_metrics), file_name="run_metrics.json", mime="application/json")
+            st.download_button("Export Prometheus (process totals)", instrumentation.to_prometheus(),
+                               file_name="rc_leads.prom", mime="text/plain")
 
 # ... (Chat & State Initialization are unchanged) ...
 if "messages" not in st.session_state: st.session_state.messages = [{"role": "assistant", "content": "What kind of place are you looking for?"}]
 if "search_results" not in st.session_state: st.session_state.search_results = []
+if "image_store" not in st.session_state: st.session_state.image_store = SessionImageStore()
+# Running selection index: place_id -> CSV record, kept in sync by the checkbox callbacks
+if "selected_records" not in st.session_state: st.session_state.selected_records = {}
+if "selection_csv" not in st.session_state: st.session_state.selection_csv = None
 for message in st.session_state.messages:
     with st.chat_message(message["role"]): st.markdown(message["content"])
 
+
+def toggle_selection(result):
+    """Checkbox callback: adds or removes one lead from the selection index."""
+    place_id = result['details']['place_id']
+    if st.session_state[f"good_{place_id}"]:
+        st.session_state.selected_records[place_id] = result_to_record(result)
+    else:
+        st.session_state.selected_records.pop(place_id, None)
+    st.session_state.selection_csv = None
+
+
+# Throttle for redrawing the live results table while a search runs
+LIVE_REFRESH_SECONDS = 1.0
+
 # --- Main Application Logic ---
 if prompt := st.chat_input("e.g., 'truck installation and accessories'"):
     st.session_state.messages.append({"role": "user", "content": prompt})
     with st.chat_message("user"): st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        with st.spinner(f"Scouting for up to {max_locations} places..."):
-            # ... (Search area selection logic is unchanged) ...
-            search_areas, search_radius, search_type = [], 0, ""
-            if search_mode == "Search by Metro Area":
-                if selected_metros: search_areas, search_radius, search_type = selected_metros, 40000, "Metro Area"
-                else: st.warning("Please select at least one metro area."); st.stop()
-            elif search_mode == "Search by Specific Zip Code(s)":
-                if selected_zips: search_areas, search_radius, search_type = selected_zips, 11265, "Zip Code"
-                else: st.warning("Please select at least one zip code."); st.stop()
-            else:
-                if ALL_ZIPS:
-                    search_areas = list(ALL_ZIPS)
-                    random.shuffle(search_areas)
-                    search_radius, search_type = 5000, "Zip Code"
-                else: st.error("`zips.csv` not found or is empty."); st.stop()
-            
-            all_results, found_place_ids = [], set()
-            for area in search_areas:
-                if len(all_results) >= max_locations: break
-                st.write(f"Searching in {search_type}: {area}...")
-                location = geocode_zip(API_KEY, area)
-                if not location: continue
+        if not search_plan:
+            if search_mode == "Search by Metro Area": st.warning("Please select at least one metro area."); st.stop()
+            elif search_mode == "Search by Specific Zip Code(s)": st.warning("Please select at least one zip code."); st.stop()
+            else: st.error("`zips.csv` not found or is empty."); st.stop()
+        if search_mode == "Search All Zips":
+            search_plan = list(search_plan)
+            random.shuffle(search_plan)
 
-                places = search_places(API_KEY, prompt, location['lat'], location['lng'], search_radius)
-                for place in places:
-                    if len(all_results) >= max_locations: break
-                    place_id = place['place_id']
-                    if place_id not in found_place_ids:
-                        details = get_place_details(API_KEY, place_id)
-                        if not details: continue
-                        
-                        # --- MODIFIED: Determine status and apply filter early ---
-                        account_type = get_account_status(details, place_id_accounts, address_accounts)
-                        
-                        if account_type in exclude_types:
-                            found_place_ids.add(place_id) # Add to found set to avoid re-processing
-                            continue # Skip this location
+        # Leads stream into session state, so stopping (any rerun) keeps what has arrived
+        st.session_state.search_results = []
+        st.session_state.selected_records = {}
+        st.session_state.selection_csv = None
+        st.session_state.results_page = 1
+        st.button("Stop search", help="Stops the run and keeps the leads found so far.")
+        area_status, live_table = st.empty(), st.empty()
+        last_refresh = [0.0]
+        failed_requests = []
 
-                        found_place_ids.add(place_id)
-                        
-                        # ... (Image processing and scoring are unchanged) ...
-                        image_labels, image_urls, image_streams = [], [], []
-                        photo_refs = [p['photo_reference'] for p in details.get('photos', [])[:3]]
-                        for ref in photo_refs:
-                            image_urls.append(get_photo_url(API_KEY, ref))
-                            img_stream = get_place_photos(API_KEY, ref)
-                            if img_stream:
-                                image_streams.append(img_stream)
-                                if not image_labels:
-                                   image_labels.extend(analyze_image_labels(img_stream.getvalue()))
-                        
-                        score = calculate_score(details, image_labels, prompt)
-                        all_results.append({
-                            "score": score, "details": details, "image_urls": image_urls, 
-                            "image_labels": list(set(image_labels)), "images": image_streams,
-                            "account_type": account_type # --- NEW: Store account type with result
-                        })
-            
-            # ... (Result handling is unchanged) ...
-            if not all_results:
-                st.warning("Sorry, no matching places were found after filtering.")
-                st.session_state.search_results = []
-            else:
-                st.session_state.search_results = sorted(all_results, key=lambda x: x['score'], reverse=False)
-                st.success(f"Found {len(st.session_state.search_results)} locations! Review and select them below.")
-                st.rerun()
+        def show_result(result):
+            st.session_state.search_results.append(result)
+            now = time.monotonic()
+            if now - last_refresh[0] >= LIVE_REFRESH_SECONDS:
+                last_refresh[0] = now
+                live_table.dataframe(pd.DataFrame(
+                    [{"Tier": r['score'], "Name": r['details'].get('name'), "Account Type": r['account_type']}
+                     for r in st.session_state.search_results]
+                ).sort_values("Tier", kind="stable"), hide_index=True)
+
+        with st.spinner(f"Scouting for up to {max_locations} places..."):
+            # Worker threads share this script's context so st.secrets and st.error inside the helpers still work
+            script_ctx = get_script_run_ctx()
+            metrics_before, run_started = instrumentation.snapshot(), time.monotonic()
+            all_results = run_search(
+                API_KEY, prompt, search_plan, max_locations, exclude_types,
+                account_index, concurrency=concurrency, max_pages=max_pages,
+                on_area=lambda circle: area_status.write(f"Searching in {search_type}: {circle['label']}..."),
+                on_result=show_result,
+                on_error=lambda circle, error: failed_requests.append(str(error)),
+                thread_initializer=lambda: add_script_run_ctx(threading.current_thread(), script_ctx),
+                options=RunOptions(use_ledger=use_ledger, skip_seen_days=skip_seen_days or None),
+            )
+            # Counters are process-wide, so searches in other sessions at the same time are included
+            st.session_state.run_metrics = dict(instrumentation.diff(metrics_before), elapsed_seconds=time.monotonic() - run_started)
+
+        if failed_requests:
+            # Kept in the chat history so it is still visible after the rerun below
+            failure_note = f"⚠️ {len(failed_requests)} Google API requests failed after retries (last: {failed_requests[-1]})."
+            st.session_state.messages.append({"role": "assistant", "content": failure_note})
+            st.warning(failure_note)
+        if not all_results:
+            st.warning("Sorry, no matching places were found after filtering.")
+        else:
+            st.success(f"Found {len(all_results)} locations! Review and select them below.")
+            st.rerun()
 
-# --- MODIFIED: Display and CSV Download ---
+# --- Display (paged, best tier first) and CSV Download ---
 if st.session_state.search_results:
-    for result in st.session_state.search_results:
+    # Re-tiers the leads already in this session from scoring_rules.json; no API calls
+    if st.sidebar.button("Re-score results", help="Applies the current scoring_rules.json to these results."):
+        changed = rescore(st.session_state.search_results)
+        selected_records = st.session_state.selected_records
+        for result in st.session_state.search_results:
+            if result['details']['place_id'] in selected_records:
+                selected_records[result['details']['place_id']] = result_to_record(result)
+        st.session_state.selection_csv = None
+        st.sidebar.caption(f"Re-scored {len(st.session_state.search_results)} results; {changed} changed tier.")
+    ranked_results = sorted(st.session_state.search_results, key=lambda x: x['score'])
+    page_col, size_col = st.columns(2)
+    with size_col:
+        page_size = st.selectbox("Results per page", (25, 50, 100), key="page_size")
+    page_count = (len(ranked_results) - 1) // page_size + 1
+    if st.session_state.get("results_page", 1) > page_count: st.session_state.results_page = page_count
+    with page_col:
+        page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, step=1, key="results_page")
+    st.caption(f"{len(ranked_results)} locations found")
+
+    for result in ranked_results[(page - 1) * page_size:page * page_size]:
         details = result['details']
         place_id = details['place_id']
         
@@ -248,48 +282,37 @@ if st.session_state.search_results:
             col1, col2 = st.columns([0.7, 0.3])
             with col1:
                 # --- MODIFIED: Display the new account type ---
-                st.markdown(f"**Account Type:** {result['account_type']}")
+                account_label = result['account_type']
+                if 0 < result.get('account_confidence', 1.0) < 1:
+                    account_label += f" ({result['account_confidence']:.0%} address match)"
+                st.markdown(f"**Account Type:** {account_label}")
                 st.markdown(f"**Address:** {details.get('formatted_address', 'N/A')}")
                 st.markdown(f"**Phone:** {details.get('formatted_phone_number', 'N/A')}")
                 st.markdown(f"**Website:** {details.get('website', 'N/A')}")
+                if result.get('first_seen'):
+                    st.caption(f"First found {time.strftime('%Y-%m-%d', time.localtime(result['first_seen']))}; reused without API calls")
             with col2:
-                st.checkbox("Good for research", key=f"good_{place_id}")
-            if result['images']:
-                st.image(result['images'], width=150)
+                st.checkbox(
+                    "Good for research", key=f"good_{place_id}",
+                    value=place_id in st.session_state.selected_records,
+                    on_change=toggle_selection, args=(result,),
+                )
+            if result['image_keys']:
+                # Thumbnails come from a memory-capped store; full-size photos are read from the API cache on demand
+                thumbnails = st.session_state.image_store.thumbnails(result['image_keys'])
+                if thumbnails:
+                    st.image(thumbnails, width=150)
+                if st.toggle("Show full-size photos", key=f"full_{place_id}"):
+                    st.image(st.session_state.image_store.originals(result['image_keys']))
 
-    good_results = []
-    for result in st.session_state.search_results:
-        place_id = result['details']['place_id']
-        if st.session_state.get(f"good_{place_id}", False):
-            good_results.append(result)
-            
-    if good_results:
+    selected_records = st.session_state.selected_records
+    if selected_records:
         st.sidebar.markdown("---")
         st.sidebar.header("Download Selections")
-        data_for_df = []
-        for res in good_results:
-            details = res['details']
-            place_id = details.get('place_id')
-            description = details.get('editorial_summary', {}).get('overview', 'N/A')
-            
-            record = {
-                "Name": details.get('name'),
-                "Account_Type": res['account_type'], # --- MODIFIED: Use new account type
-                "Score": res['score'],
-                "Address": details.get('formatted_address'), "Phone": details.get('formatted_phone_number'),
-                "Website": details.get('website'), "PlaceID": place_id, "Description": description,
-                "Google_Types": ', '.join(details.get('types', [])), "Detected_Image_Keywords": ', '.join(res['image_labels']),
-                "Image_URL_1": res['image_urls'][0] if len(res['image_urls']) > 0 else None,
-                "Image_URL_2": res['image_urls'][1] if len(res['image_urls']) > 1 else None,
-                "Image_URL_3": res['image_urls'][2] if len(res['image_urls']) > 2 else None,
-            }
-            data_for_df.append(record)
-        df = pd.DataFrame(data_for_df)
-        csv = df.to_csv(index=False).encode('utf-8')
+        # The CSV is only rebuilt after the selection changes
+        if st.session_state.selection_csv is None:
+            st.session_state.selection_csv = pd.DataFrame(list(selected_records.values())).to_csv(index=False).encode('utf-8')
         st.sidebar.download_button(
-           label=f"Download {len(good_results)} Selected Locations", data=csv,
+           label=f"Download {len(selected_records)} Selected Locations", data=st.session_state.selection_csv,
            file_name=f"selected_locations.csv", mime="text/csv",
         )
-
-
-
@@ -0,0 +1,101 @@
+# account_index.py
+
+import os
+import pickle
+
+import pandas as pd
+
+from address_matcher import AddressMatcher
+from local_store import file_signature
+
+INDEX_DIR = os.environ.get("RC_LEADS_INDEX_DIR", ".cache")
+
+
+class AccountIndex:
+    """Lookup tables that map Google places to existing account types."""
+
+    # Bumped whenever the pickled layout changes, so old artifacts are rebuilt
+    VERSION = 2
+
+    def __init__(self, place_id_map=None, address_matcher=None, signature=None):
+        self.place_id_map = place_id_map or {}
+        self.address_matcher = address_matcher or AddressMatcher()
+        self.signature = signature
+        self.version = self.VERSION
+
+    def __len__(self):
+        return len(self.place_id_map) + len(self.address_matcher)
+
+    @classmethod
+    def from_csv(cls, filename):
+        """Builds the index from accounts.csv; addresses are normalized as whole columns, then bucketed by zip and number."""
+        wanted = {"place_id", "addr", "zipcode", "sap_account_type"}
+        df = pd.read_csv(filename, dtype=str, usecols=lambda column: column in wanted)
+
+        place_id_map, address_matcher = {}, AddressMatcher()
+        # Create a map for place_id -> sap_account_type
+        if {"place_id", "sap_account_type"} <= set(df.columns):
+            id_df = df.dropna(subset=["place_id", "sap_account_type"])
+            place_id_map = dict(zip(id_df["place_id"], id_df["sap_account_type"]))
+
+        # Index addresses by zip and street number for fuzzy matching
+        if {"addr", "zipcode", "sap_account_type"} <= set(df.columns):
+            addr_df = df.dropna(subset=["addr", "zipcode", "sap_account_type"])
+            address_matcher.add_many(addr_df["addr"], addr_df["zipcode"].str.strip().str.zfill(5), addr_df["sap_account_type"])
+
+        return cls(place_id_map, address_matcher, file_signature(filename))
+
+    def match(self, place):
+        """Returns (account type, confidence) for one place (a search result or details payload)."""
+        return self.matches([place])[0]
+
+    def matches(self, places):
+        """Returns (account type, confidence) for many places: place_id first, then fuzzy address match."""
+        results = [(self.place_id_map.get(place.get("place_id")), 1.0) for place in places]
+        # Only the places without a known place_id are address-matched
+        unmatched = [i for i, (account_type, _) in enumerate(results) if account_type is None]
+        if unmatched:
+            addresses = [places[i].get("formatted_address") or "" for i in unmatched]
+            for i, (account_type, confidence) in zip(unmatched, self.address_matcher.match_many(addresses)):
+                results[i] = (account_type, confidence) if account_type is not None else ("New", 0.0)
+        return results
+
+    def status(self, place):
+        """Returns just the account type for one place."""
+        return self.match(place)[0]
+
+    def statuses(self, places):
+        """Returns just the account types for many places."""
+        return [account_type for account_type, _ in self.matches(places)]
+
+
+def _index_path(filename):
+    return os.path.join(INDEX_DIR, os.path.basename(filename) + ".index.pkl")
+
+
+def load_account_index(filename="accounts.csv"):
+    """Loads the compiled index, rebuilding it only when accounts.csv has changed.
+
+    Returns an empty index if the CSV does not exist.
+    """
+    try:
+        signature = file_signature(filename)
+    except FileNotFoundError:
+        return AccountIndex()
+
+    index_path = _index_path(filename)
+    try:
+        with open(index_path, "rb") as f:
+            index = pickle.load(f)
+        if isinstance(index, AccountIndex) and index.signature == signature and getattr(index, "version", None) == AccountIndex.VERSION:
+            return index
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass  # Missing or stale artifact; rebuild below
+
+    index = AccountIndex.from_csv(filename)
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, index_path)
+    return index
@@ -0,0 +1,134 @@
+# address_matcher.py
+
+import re
+from collections import defaultdict
+
+import pandas as pd
+
+# Street suffixes and directionals, normalized to USPS abbreviations
+ABBREVIATIONS = {
+    "street": "st", "str": "st", "road": "rd", "avenue": "ave", "av": "ave", "boulevard": "blvd",
+    "drive": "dr", "lane": "ln", "highway": "hwy", "hiway": "hwy", "parkway": "pkwy", "pky": "pkwy",
+    "court": "ct", "place": "pl", "circle": "cir", "terrace": "ter", "trail": "trl", "way": "wy",
+    "square": "sq", "expressway": "expy", "freeway": "fwy", "turnpike": "tpke", "route": "rte",
+    "center": "ctr", "plaza": "plz", "crossing": "xing", "loop": "loop", "pike": "pike",
+    "north": "n", "south": "s", "east": "e", "west": "w",
+    "northeast": "ne", "northwest": "nw", "southeast": "se", "southwest": "sw",
+    "first": "1st", "second": "2nd", "third": "3rd", "fourth": "4th", "fifth": "5th",
+}
+
+# Unit designators; they and the token after them are dropped
+UNIT_WORDS = {"suite", "ste", "unit", "apt", "apartment", "bldg", "building", "fl", "floor", "rm", "room", "lot", "spc", "space"}
+
+ZIP_PATTERN = re.compile(r"\b(\d{5})(?:-\d{4})?\b")
+TOKEN_PATTERN = re.compile(r"#|[a-z0-9]+")
+
+# Applied in order to the street tokens joined with single spaces (plus a leading space),
+# so single addresses and whole columns are normalized by the same expressions
+UNIT_PATTERN = re.compile(r" (?:" + "|".join(sorted(UNIT_WORDS)) + r"|#)(?= |$)(?: [^ ]+)?")
+ABBREVIATION_PATTERN = re.compile(r"(?<= )(?:" + "|".join(sorted(ABBREVIATIONS, key=len, reverse=True)) + r")(?= |$)")
+NUMBER_PATTERN = re.compile(r"^ (\d[a-z0-9]*)(?= |$)")
+
+# Below this confidence a candidate is not treated as the same business
+MATCH_THRESHOLD = 0.7
+
+
+def _abbreviate(match):
+    return ABBREVIATIONS[match.group(0)]
+
+
+def parse_address(address, zip_code=None):
+    """Splits a one-line US address into (zip, street number, normalized street name)."""
+    text = str(address).lower()
+    if zip_code is None:
+        # The last 5-digit group is the zip; a leading 5-digit street number must not win
+        zips = ZIP_PATTERN.findall(text)
+        zip_code = zips[-1] if zips else ""
+
+    # A unit designator is dropped together with the token after it
+    street = " " + " ".join(TOKEN_PATTERN.findall(text.split(",")[0]))
+    street = ABBREVIATION_PATTERN.sub(_abbreviate, UNIT_PATTERN.sub("", street))
+    match = NUMBER_PATTERN.match(street)
+    number = match.group(1) if match else ""
+    return str(zip_code).strip(), number, street[match.end() if match else 0:].strip()
+
+
+def parse_addresses(addresses, zip_codes=None):
+    """parse_address for a whole column with pandas string operations; returns (zips, numbers, streets) Series."""
+    text = pd.Series(addresses, dtype=object).astype(str).str.lower()
+    if zip_codes is None:
+        zip_codes = text.str.findall(ZIP_PATTERN).str[-1].fillna("")
+    else:
+        zip_codes = pd.Series(zip_codes, index=text.index, dtype=object).astype(str)
+
+    street = " " + text.str.split(",", n=1).str[0].str.findall(TOKEN_PATTERN).str.join(" ")
+    street = street.str.replace(UNIT_PATTERN, "", regex=True).str.replace(ABBREVIATION_PATTERN, _abbreviate, regex=True)
+    numbers = street.str.extract(NUMBER_PATTERN, expand=False).fillna("")
+    streets = street.str.replace(NUMBER_PATTERN, "", regex=True).str.strip()
+    return zip_codes.str.strip(), numbers, streets
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """Scores two normalized street names from 0 to 1 (token Jaccard blended with trigram Dice)."""
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    tokens_a, tokens_b = set(a.split()), set(b.split())
+    jaccard = len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+    grams_a, grams_b = _trigrams(a), _trigrams(b)
+    dice = 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+    return (jaccard + dice) / 2
+
+
+class AddressMatcher:
+    """Blocked fuzzy matcher: accounts are indexed by zip, then street number.
+
+    A lookup only scores the handful of accounts in its (zip, number) block, so
+    it stays well under a millisecond against the full accounts file.
+    """
+
+    def __init__(self):
+        self._blocks = defaultdict(list)
+
+    def __len__(self):
+        return sum(len(block) for block in self._blocks.values())
+
+    def add(self, address, zip_code, value):
+        zip_key, number, street = parse_address(address, zip_code)
+        if zip_key:
+            self._blocks[(zip_key, number)].append((street, value))
+
+    def add_many(self, addresses, zip_codes, values):
+        zip_keys, numbers, streets = parse_addresses(addresses, zip_codes)
+        for zip_key, number, street, value in zip(zip_keys, numbers, streets, values):
+            if zip_key:
+                self._blocks[(zip_key, number)].append((street, value))
+
+    def match(self, address):
+        """Returns (value, confidence) for the best account at this address, or (None, 0.0)."""
+        return self._best(*parse_address(address))
+
+    def match_many(self, addresses):
+        """match for a list of addresses."""
+        # A page of search results is ~20 addresses, too few to pay for building Series
+        return [self._best(*parse_address(address)) for address in addresses]
+
+    def _best(self, zip_key, number, street):
+        if not zip_key:
+            return None, 0.0
+
+        best_value, best_score = None, 0.0
+        for candidate, value in self._blocks.get((zip_key, number), ()):
+            score = similarity(street, candidate)
+            # Later rows win ties, matching how the accounts file was loaded before
+            if score >= best_score:
+                best_value, best_score = value, score
+        if best_score < MATCH_THRESHOLD:
+            return None, 0.0
+        return best_value, round(best_score, 3)
@@ -0,0 +1,152 @@
+# api_cache.py
+
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+
+import local_store
+from local_store import DAY
+
+# One SQLite file shared by every Streamlit session and worker process on the machine
+CACHE_PATH = os.environ.get("RC_LEADS_CACHE", os.path.join(".cache", "api_cache.sqlite"))
+
+# How long each endpoint's responses stay fresh, in seconds
+ENDPOINT_TTLS = {
+    "geocode": 30 * DAY,
+    "textsearch": 7 * DAY,
+    "details": 30 * DAY,
+    "photo": 30 * DAY,
+    "vision": 365 * DAY,
+}
+
+# Endpoints whose values are raw bytes rather than JSON
+BINARY_ENDPOINTS = {"photo"}
+
+# Photo bytes are the only entries that grow without bound, so they get an LRU size cap
+PHOTO_CACHE_MAX_BYTES = int(os.environ.get("RC_LEADS_PHOTO_CACHE_MB", "512")) * 1024 * 1024
+EVICTION_CHECK_EVERY = 50
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS api_cache ("
+    " endpoint TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+    " size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL,"
+    " PRIMARY KEY (endpoint, key))",
+    "CREATE INDEX IF NOT EXISTS api_cache_lru ON api_cache (endpoint, accessed)",
+)
+
+_stats_lock = threading.Lock()
+_stats = {}
+_photo_puts = 0
+
+
+def get_connection():
+    """Returns this thread's connection to the cache database, creating it if needed."""
+    return local_store.get_connection(CACHE_PATH, SCHEMA)
+
+
+def make_key(*parts):
+    """Hashes JSON-serializable key parts into a stable cache key."""
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _count(endpoint, outcome):
+    with _stats_lock:
+        counts = _stats.setdefault(endpoint, {"hits": 0, "misses": 0})
+        counts[outcome] += 1
+
+
+def stats():
+    """Returns hit/miss counters per endpoint for this process."""
+    with _stats_lock:
+        return {endpoint: dict(counts) for endpoint, counts in _stats.items()}
+
+
+def get(endpoint, key, count=True):
+    """Returns the cached value for `key`, or None if it is missing or expired.
+
+    Reads made with count=False (e.g. the UI showing stored photos) leave the hit/miss counters alone.
+    """
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT value, created FROM api_cache WHERE endpoint = ? AND key = ?", (endpoint, key)
+    ).fetchone()
+    now = time.time()
+    if row is None or now - row[1] > ENDPOINT_TTLS.get(endpoint, 7 * DAY):
+        if count:
+            _count(endpoint, "misses")
+        return None
+
+    if count:
+        _count(endpoint, "hits")
+    if endpoint in BINARY_ENDPOINTS:
+        # Only size-capped entries need their access time kept up to date
+        conn.execute("UPDATE api_cache SET accessed = ? WHERE endpoint = ? AND key = ?", (now, endpoint, key))
+        return bytes(row[0])
+    return json.loads(row[0])
+
+
+def put(endpoint, key, value):
+    """Stores a value, replacing any previous entry for the same key."""
+    global _photo_puts
+    blob = value if endpoint in BINARY_ENDPOINTS else json.dumps(value)
+    now = time.time()
+    get_connection().execute(
+        "INSERT OR REPLACE INTO api_cache (endpoint, key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+        (endpoint, key, blob, len(blob), now, now),
+    )
+    if endpoint == "photo":
+        _photo_puts += 1
+        if _photo_puts % EVICTION_CHECK_EVERY == 0:
+            evict_photos()
+
+
+def evict_photos(max_bytes=None):
+    """Deletes least recently used photos until the photo cache is under its size cap."""
+    max_bytes = PHOTO_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    conn = get_connection()
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM api_cache WHERE endpoint = 'photo'").fetchone()[0]
+    if total <= max_bytes:
+        return 0
+
+    # Free a little extra so we are not evicting again on the next put
+    to_free, freed, stale_keys = total - int(max_bytes * 0.9), 0, []
+    for key, size in conn.execute("SELECT key, size FROM api_cache WHERE endpoint = 'photo' ORDER BY accessed"):
+        if freed >= to_free:
+            break
+        stale_keys.append((key,))
+        freed += size
+    conn.executemany("DELETE FROM api_cache WHERE endpoint = 'photo' AND key = ?", stale_keys)
+    return len(stale_keys)
+
+
+def purge_expired():
+    """Removes every entry that is past its endpoint's TTL."""
+    now = time.time()
+    conn = get_connection()
+    for endpoint, ttl in ENDPOINT_TTLS.items():
+        conn.execute("DELETE FROM api_cache WHERE endpoint = ? AND created < ?", (endpoint, now - ttl))
+
+
+def cached(endpoint, key_func=None):
+    """Caches a helper's result in the shared store.
+
+    By default the first argument (the API key) is left out of the cache key.
+    Empty results (None, [], {}) are not stored, so failed calls are retried.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = key_func(*args, **kwargs) if key_func else make_key(func.__name__, args[1:], kwargs)
+            value = get(endpoint, key)
+            if value is not None:
+                return value
+            value = func(*args, **kwargs)
+            if value:
+                put(endpoint, key, value)
+            return value
+        return wrapper
+    return decorator
@@ -0,0 +1,316 @@
+# batch_job.py
+"""Runs lead searches headless, with checkpoints so an interrupted job can resume.
+
+    python batch_job.py init jobs/overnight --query "truck accessories" --mode all-zips --exclude Customer
+    python batch_job.py run jobs/overnight --worker 0 --workers 4     # one per process or machine
+    python batch_job.py status jobs/overnight
+    python batch_job.py merge jobs/overnight                          # -> jobs/overnight/leads.csv
+    python batch_job.py rescore jobs/overnight                        # re-tier leads.csv after editing scoring_rules.json
+
+Each worker takes every Nth circle of the job's plan, writes its leads as CSV
+chunks under leads/, and records completed circles, seen place_ids and the
+API calls spent in checkpoint-w<worker>.json. Re-running the same command
+resumes after the last checkpoint. Per-endpoint and per-stage metrics of the
+latest run go to metrics-w<worker>.json.
+"""
+
+import argparse
+import glob
+import json
+import math
+import os
+import random
+import signal
+import sys
+import threading
+import time
+
+import pandas as pd
+
+import instrumentation
+from account_index import load_account_index
+from search_planner import plan_search, plan_summary, METRO_RADIUS_M, ZIP_RADIUS_M, ALL_ZIPS_RADIUS_M
+from pipeline import run_search, result_to_record, RunOptions, DEFAULT_CONCURRENCY, MAX_PAGES
+from scorer import get_rules, records_frame
+from zip_centroids import load_zip_codes
+
+MODES = {"metros": METRO_RADIUS_M, "zips": ZIP_RADIUS_M, "all-zips": ALL_ZIPS_RADIUS_M}
+
+# A checkpoint (and leads chunk) is written after this long or this many leads, whichever comes first
+CHECKPOINT_EVERY_SECONDS = 30
+CHUNK_ROWS = 500
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path, default=None):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def get_api_key():
+    """Reads the Places API key from GOOGLE_API_KEY, falling back to Streamlit secrets."""
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if api_key:
+        return api_key
+    import streamlit as st
+    return st.secrets["GOOGLE_API_KEY"]
+
+
+def paid_calls():
+    """Billed API calls this process has made so far, per endpoint (images, for Vision)."""
+    return {endpoint: stat["units"] for endpoint, stat in instrumentation.snapshot()["api"].items()}
+
+
+def init_job(job_dir, query, mode, areas=(), exclude_types=(), max_leads=10000, seed=None, max_pages=MAX_PAGES,
+             skip_seen_days=None):
+    """Plans a job and saves it, so every worker (and every resume) uses the same circles."""
+    if os.path.exists(os.path.join(job_dir, "job.json")):
+        raise SystemExit(f"{job_dir} already holds a job")
+    if mode == "all-zips":
+        areas = load_zip_codes()
+    if not areas:
+        raise SystemExit("No search areas given")
+
+    job = {
+        "query": query, "mode": mode, "exclude_types": list(exclude_types),
+        "max_leads": max_leads, "max_pages": max_pages, "skip_seen_days": skip_seen_days, "created": time.time(),
+    }
+    plan = plan_search(areas, MODES[mode])
+    if seed is not None:
+        random.Random(seed).shuffle(plan)
+
+    os.makedirs(os.path.join(job_dir, "leads"), exist_ok=True)
+    _write_json(os.path.join(job_dir, "plan.json"), plan)
+    _write_json(os.path.join(job_dir, "job.json"), job)
+    return plan
+
+
+class Checkpoint:
+    """One worker's progress: completed circles, seen place_ids, chunks written and calls spent."""
+
+    def __init__(self, job_dir, worker):
+        self.job_dir = job_dir
+        self.worker = worker
+        self.path = os.path.join(job_dir, f"checkpoint-w{worker}.json")
+        state = _read_json(self.path, {})
+        self.completed = set(state.get("completed", []))
+        self.seen_place_ids = set(state.get("seen_place_ids", []))
+        self.chunks = state.get("chunks", 0)
+        self.leads = state.get("leads", 0)
+        self.budget_used = state.get("budget_used", {})
+
+    def write_chunk(self, rows):
+        """Writes leads from completed circles; the chunk number only advances with the checkpoint."""
+        if not rows:
+            return
+        path = os.path.join(self.job_dir, "leads", f"leads-w{self.worker}-{self.chunks:05d}.csv")
+        pd.DataFrame(rows).to_csv(path, index=False)
+        self.chunks += 1
+        self.leads += len(rows)
+
+    def save(self, calls_this_run):
+        budget_used = dict(self.budget_used)
+        for endpoint, calls in calls_this_run.items():
+            budget_used[endpoint] = budget_used.get(endpoint, 0) + calls
+        _write_json(self.path, {
+            "completed": sorted(self.completed), "seen_place_ids": sorted(self.seen_place_ids),
+            "chunks": self.chunks, "leads": self.leads, "budget_used": budget_used, "updated": time.time(),
+        })
+        return budget_used
+
+
+def run_worker(job_dir, worker=0, workers=1, concurrency=DEFAULT_CONCURRENCY, budget=None, accounts="accounts.csv", log=print):
+    """Runs (or resumes) one worker's share of a job until it finishes, runs out of budget or is stopped."""
+    job = _read_json(os.path.join(job_dir, "job.json"))
+    plan = _read_json(os.path.join(job_dir, "plan.json"))
+    if job is None or plan is None:
+        raise SystemExit(f"No job in {job_dir}; run 'init' first")
+
+    checkpoint = Checkpoint(job_dir, worker)
+    circles = [
+        dict(circle, index=i) for i, circle in enumerate(plan)
+        if i % workers == worker and i not in checkpoint.completed
+    ]
+    max_leads = math.ceil(job["max_leads"] / workers) - checkpoint.leads
+    log(f"Worker {worker}/{workers}: {len(circles)} circles left, {checkpoint.leads} leads so far")
+    if not circles or max_leads <= 0:
+        return checkpoint
+
+    start_calls = paid_calls()
+    start_metrics = instrumentation.snapshot()
+    prior_calls = sum(checkpoint.budget_used.values())
+    cancel_event = threading.Event()
+    pending_rows, done_rows = [], []
+    last_save = [time.monotonic()]
+
+    def calls_this_run():
+        now = paid_calls()
+        return {endpoint: now[endpoint] - start_calls.get(endpoint, 0) for endpoint in now}
+
+    def save():
+        checkpoint.write_chunk(done_rows)
+        done_rows.clear()
+        budget_used = checkpoint.save(calls_this_run())
+        last_save[0] = time.monotonic()
+        return budget_used
+
+    def check_budget(*_):
+        # Checked per lead and per circle read, so spending stops within a few in-flight calls
+        if budget is not None and not cancel_event.is_set() and prior_calls + sum(calls_this_run().values()) >= budget:
+            log("API budget reached; stopping")
+            cancel_event.set()
+
+    def on_result(result):
+        pending_rows.append(result_to_record(result))
+        check_budget()
+
+    def on_area_done(circle, place_ids):
+        # Every lead buffered so far belongs to this or an earlier, now finished, circle
+        done_rows.extend(pending_rows)
+        pending_rows.clear()
+        checkpoint.completed.add(circle["index"])
+        checkpoint.seen_place_ids.update(place_ids)
+        if len(done_rows) >= CHUNK_ROWS or time.monotonic() - last_save[0] >= CHECKPOINT_EVERY_SECONDS:
+            budget_used = save()
+            log(f"Checkpoint: {len(checkpoint.completed)} circles done, {checkpoint.leads} leads, {sum(budget_used.values())} API calls")
+        check_budget()
+
+    def on_error(circle, error):
+        log(f"Circle {circle['index']} ({circle['label']}) failed and will be retried on resume: {error}")
+
+    def stop(signum, frame):
+        log("Stopping after in-flight work; progress is checkpointed")
+        cancel_event.set()
+
+    # Signal handlers can only be installed from the main thread
+    previous_handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        previous_handlers = {sig: signal.signal(sig, stop) for sig in (signal.SIGINT, signal.SIGTERM)}
+
+    try:
+        run_search(
+            get_api_key(), job["query"], circles, max_leads, job["exclude_types"],
+            load_account_index(accounts), concurrency=concurrency, max_pages=job.get("max_pages", MAX_PAGES),
+            on_area=check_budget, on_result=on_result, on_area_done=on_area_done, on_error=on_error, cancel_event=cancel_event,
+            seen_place_ids=set(checkpoint.seen_place_ids),
+            options=RunOptions(
+                # Only sightings from before the job count, so a resume keeps the leads its own earlier runs recorded
+                use_ledger=True, skip_seen_days=job.get("skip_seen_days"), skip_seen_until=job["created"],
+                # Circles cut short by the lead cap still complete, so a resume moves past them
+                finish_started_areas=True,
+            ),
+        )
+    finally:
+        # Leads from circles that did not finish (cancelled or failed) are dropped; a resume redoes those circles from cache
+        save()
+        for sig, handler in previous_handlers.items():
+            signal.signal(sig, handler)
+        run_metrics = instrumentation.diff(start_metrics)
+        with open(os.path.join(job_dir, f"metrics-w{worker}.json"), "w") as f:
+            f.write(instrumentation.to_json(run_metrics))
+        log(f"Estimated API cost this run: ${sum(instrumentation.estimated_cost(run_metrics).values()):.2f}")
+    log(f"Worker {worker} stopped: {len(checkpoint.completed)} circles done, {checkpoint.leads} leads")
+    return checkpoint
+
+
+def job_status(job_dir):
+    plan = _read_json(os.path.join(job_dir, "plan.json"), [])
+    checkpoints = [_read_json(path) for path in sorted(glob.glob(os.path.join(job_dir, "checkpoint-w*.json")))]
+    return {
+        "circles": len(plan),
+        "completed": sum(len(c["completed"]) for c in checkpoints),
+        "leads": sum(c["leads"] for c in checkpoints),
+        "api_calls": sum(sum(c["budget_used"].values()) for c in checkpoints),
+        "workers": len(checkpoints),
+    }
+
+
+def merge_leads(job_dir):
+    """Concatenates every worker's chunks into leads.csv, dropping places found by more than one worker."""
+    paths = sorted(glob.glob(os.path.join(job_dir, "leads", "leads-w*.csv")))
+    if not paths:
+        return 0
+    df = pd.concat([pd.read_csv(path, dtype=str) for path in paths], ignore_index=True)
+    df = df.drop_duplicates(subset=["PlaceID"]).sort_values("Score", kind="stable")
+    df.to_csv(os.path.join(job_dir, "leads.csv"), index=False)
+    return len(df)
+
+
+def rescore_leads(job_dir):
+    """Re-tiers a merged leads.csv with the current scoring rules; returns how many leads changed tier."""
+    path = os.path.join(job_dir, "leads.csv")
+    if not os.path.exists(path):
+        raise SystemExit(f"No leads.csv in {job_dir}; run 'merge' first")
+    df = pd.read_csv(path, dtype=str)
+    tiers = get_rules().score_frame(records_frame(df))["tier"].astype(str)
+    changed = int((tiers != df["Score"]).sum())
+    df["Score"] = tiers
+    df.sort_values("Score", kind="stable").to_csv(path, index=False)
+    return changed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless Rough Country lead generation jobs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    init = commands.add_parser("init", help="plan a new job")
+    init.add_argument("job_dir")
+    init.add_argument("--query", required=True)
+    init.add_argument("--mode", choices=sorted(MODES), default="all-zips")
+    init.add_argument("--areas", nargs="*", default=[], help="zip codes or metro names for the zips/metros modes")
+    init.add_argument("--exclude", nargs="*", default=[], choices=["Customer", "Lead", "Prospect"])
+    init.add_argument("--max-leads", type=int, default=10000)
+    init.add_argument("--seed", type=int, help="shuffle the plan with this seed")
+    init.add_argument("--max-pages", type=int, default=MAX_PAGES, choices=range(1, MAX_PAGES + 1), help="Text Search pages per circle")
+    init.add_argument("--skip-seen-days", type=int, help="leave out places any earlier search found in the last N days")
+
+    run = commands.add_parser("run", help="run or resume one worker")
+    run.add_argument("job_dir")
+    run.add_argument("--worker", type=int, default=0)
+    run.add_argument("--workers", type=int, default=1)
+    run.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    run.add_argument("--budget", type=int, help="stop once this worker has made this many API calls")
+    run.add_argument("--accounts", default="accounts.csv")
+
+    status = commands.add_parser("status", help="show job progress")
+    status.add_argument("job_dir")
+
+    merge = commands.add_parser("merge", help="combine worker outputs into leads.csv")
+    merge.add_argument("job_dir")
+
+    rescore = commands.add_parser("rescore", help="re-tier leads.csv with the current scoring rules")
+    rescore.add_argument("job_dir")
+
+    args = parser.parse_args(argv)
+    if args.command == "init":
+        plan = init_job(args.job_dir, args.query, args.mode, args.areas, args.exclude, args.max_leads, args.seed, args.max_pages,
+                        args.skip_seen_days)
+        stats = plan_summary(plan)
+        print(f"Planned {stats['searches']} searches for {stats['areas']} areas ({stats['geocodes']} need geocoding)")
+    elif args.command == "run":
+        if not 0 <= args.worker < args.workers:
+            parser.error("--worker must be between 0 and --workers - 1")
+        run_worker(args.job_dir, args.worker, args.workers, args.concurrency, args.budget, args.accounts)
+    elif args.command == "status":
+        print(json.dumps(job_status(args.job_dir), indent=2))
+    elif args.command == "merge":
+        merged = merge_leads(args.job_dir)
+        if merged:
+            print(f"Wrote {merged} leads to {os.path.join(args.job_dir, 'leads.csv')}")
+        else:
+            print("No leads to merge yet")
+    elif args.command == "rescore":
+        print(f"{rescore_leads(args.job_dir)} leads changed tier")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
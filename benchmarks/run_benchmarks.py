@@ -0,0 +1,261 @@
+# benchmarks/run_benchmarks.py
+"""Offline performance benchmarks for the lead pipeline.
+
+    python benchmarks/run_benchmarks.py                      # run, compare with benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --update-baseline    # accept the current numbers as the baseline
+    python benchmarks/run_benchmarks.py --areas 200 --error-rate 0.02 --output results.json
+
+Every Google request is answered by fake_google.FakeGoogleAdapter and every
+Vision batch by vision_stage.FakeVisionClient, with fixed simulated latencies,
+so no network access or API key is needed. Caches, the centroid table, image
+store and lead ledger live in a temporary directory.
+
+Measured:
+  startup   account index build and load from accounts.csv, zip list load from zips.csv
+  cold      a search over randomly chosen zips with empty caches: leads/s, paid calls,
+            p50/p99 latency per API endpoint and pipeline stage, peak traced memory
+  warm      the same search again, served by the API cache and lead ledger
+
+Metrics that got worse than the baseline by more than their tolerance are
+flagged, and the exit status is 1 if any were. Warm-pass timings and call
+counts, and percentiles taken over fewer than MIN_SAMPLES samples, are reported
+but not gated.
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(REPO_DIR, "benchmarks", "baseline.json")
+ENDPOINTS = ("geocode", "textsearch", "details", "photo")
+
+# (metric name suffix, direction, relative tolerance, absolute slack); the first match wins.
+# Direction +1 means higher is better. Slack stops tiny absolute changes in small numbers from flagging.
+TOLERANCES = [
+    ("leads_per_s", +1, 0.25, 0.0),
+    ("_calls", -1, 0.10, 2),
+    ("_ms", -1, 0.50, 5.0),
+    ("_mb", -1, 0.25, 5.0),
+    ("_s", -1, 0.50, 0.05),
+]
+
+# The warm pass takes a fraction of a second, so its timings are noise. Its paid calls come
+# from the speculative place tasks the cold pass cut off at max_leads, and how many of those
+# had finished depends on thread timing, so they are not gated either; the cold counts are
+UNGATED_WARM = ("leads_per_s", "seconds", "p99_ms", "_calls")
+
+# A percentile over fewer samples than this is a handful of calls, and is not gated;
+# a p99 over fewer than 100 is just the slowest call
+MIN_SAMPLES = {"p50_ms": 20, "p99_ms": 100}
+
+# Startup steps run once each, so they are timed as the best of this many runs
+STARTUP_REPEATS = 3
+
+
+def isolate(work_dir, real_rates, zips):
+    """Points every on-disk store at `work_dir`; must run before the app modules are imported."""
+    os.environ.update({
+        "RC_LEADS_CACHE": os.path.join(work_dir, "api_cache.sqlite"),
+        "RC_LEADS_CENTROIDS": os.path.join(work_dir, "centroids.npy"),
+        "RC_LEADS_CENTROID_SEED": zips,
+        "RC_LEADS_INDEX_DIR": os.path.join(work_dir, "index"),
+        "RC_LEADS_IMAGE_DIR": os.path.join(work_dir, "images"),
+        "RC_LEADS_LEDGER": os.path.join(work_dir, "lead_ledger.sqlite"),
+    })
+    if not real_rates:
+        # Measure the pipeline, not the client-side rate limits
+        for endpoint in ENDPOINTS:
+            os.environ[f"RC_LEADS_RATE_{endpoint.upper()}"] = "100000"
+    sys.path.insert(0, REPO_DIR)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    value = func(*args)
+    return value, time.perf_counter() - start
+
+
+def best_of(repeats, func, *args, setup=None):
+    """Like timed, but runs `func` `repeats` times (after `setup`, if given) and keeps the fastest time."""
+    best = None
+    for _ in range(repeats):
+        if setup:
+            setup()
+        value, seconds = timed(func, *args)
+        best = seconds if best is None else min(best, seconds)
+    return value, best
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def bench_startup(accounts, zips):
+    from account_index import load_account_index
+    from zip_centroids import load_zip_codes
+
+    def drop_index():
+        shutil.rmtree(os.environ["RC_LEADS_INDEX_DIR"], ignore_errors=True)
+
+    metrics = {}
+    index, metrics["startup.accounts_cold_s"] = best_of(STARTUP_REPEATS, load_account_index, accounts, setup=drop_index)
+    _, metrics["startup.accounts_warm_s"] = best_of(STARTUP_REPEATS, load_account_index, accounts)
+    zip_codes, metrics["startup.zips_s"] = best_of(STARTUP_REPEATS, load_zip_codes, zips)
+
+    tracemalloc.start()
+    load_account_index(accounts)
+    metrics["startup.accounts_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    metrics["startup.accounts_rows"] = len(index)
+    metrics["startup.zips_rows"] = len(zip_codes)
+    return index, zip_codes, metrics
+
+
+def bench_search(label, plan, index, args, trace_memory=False):
+    import instrumentation
+    from pipeline import run_search, RunOptions
+
+    before = instrumentation.snapshot()
+    if trace_memory:
+        tracemalloc.start()
+    with instrumentation.collect_samples() as samples:
+        results, elapsed = timed(lambda: run_search(
+            "benchmark-key", args.query, plan, args.max_leads, ["Customer"], index,
+            concurrency=args.concurrency, options=RunOptions(use_ledger=True),
+        ))
+    metrics = {}
+    if trace_memory:
+        metrics[f"{label}.peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+
+    run = instrumentation.diff(before)
+    metrics[f"{label}.leads"] = len(results)
+    metrics[f"{label}.seconds"] = elapsed
+    metrics[f"{label}.leads_per_s"] = len(results) / elapsed if elapsed else 0.0
+    for endpoint, stat in run["api"].items():
+        metrics[f"{label}.paid.{endpoint}_calls"] = stat["units"]
+    metrics[f"{label}.estimated_cost_usd"] = sum(instrumentation.estimated_cost(run).values())
+    for (family, name), seconds in sorted(samples.items()):
+        metrics[f"{label}.{family}.{name}.samples"] = len(seconds)
+        metrics[f"{label}.{family}.{name}.p50_ms"] = 1000 * percentile(seconds, 50)
+        metrics[f"{label}.{family}.{name}.p99_ms"] = 1000 * percentile(seconds, 99)
+    return metrics
+
+
+def gated(name, metrics, baseline):
+    """False for metrics too noisy to compare: warm timings and percentiles over too few samples."""
+    if name.startswith("warm.") and name.endswith(UNGATED_WARM):
+        return False
+    prefix, _, statistic = name.rpartition(".")
+    if statistic in MIN_SAMPLES:
+        samples = f"{prefix}.samples"
+        return min(metrics.get(samples, 0), baseline.get(samples, 0)) >= MIN_SAMPLES[statistic]
+    return True
+
+
+def compare(metrics, baseline):
+    """Returns (name, baseline value, current value) for every gated metric that regressed."""
+    regressions = []
+    for name, value in metrics.items():
+        old = baseline.get(name)
+        if old is None or not gated(name, metrics, baseline):
+            continue
+        for suffix, direction, tolerance, slack in TOLERANCES:
+            if name.endswith(suffix):
+                worse_by = (old - value) if direction > 0 else (value - old)
+                if worse_by > max(abs(old) * tolerance, slack):
+                    regressions.append((name, old, value))
+                break
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks with a local Google API stand-in.")
+    parser.add_argument("--areas", type=int, default=60, help="zip codes to search")
+    parser.add_argument("--max-leads", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--query", default="truck accessories installation")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply every simulated latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake requests failing with 5xx")
+    parser.add_argument("--vision-latency", type=float, default=0.2, help="seconds per Vision batch")
+    parser.add_argument("--real-rates", action="store_true", help="keep http_client's per-endpoint rate limits")
+    parser.add_argument("--accounts", default=os.path.join(REPO_DIR, "accounts.csv"))
+    parser.add_argument("--zips", default=os.path.join(REPO_DIR, "zips.csv"))
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", help="also write the results JSON here")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="rc-leads-bench-")
+    isolate(work_dir, args.real_rates, args.zips)
+
+    import pandas as pd
+
+    import fake_google
+    import vision_stage
+    from search_planner import plan_search, ALL_ZIPS_RADIUS_M
+
+    index, zip_codes, metrics = bench_startup(args.accounts, args.zips)
+
+    known_place_ids = pd.read_csv(args.accounts, usecols=["place_id"], dtype=str)["place_id"].dropna()
+    latency = {endpoint: seconds * args.latency_scale for endpoint, seconds in fake_google.DEFAULT_LATENCY.items()}
+    adapter = fake_google.install(fake_google.FakeGoogleAdapter(
+        latency=latency, error_rate=args.error_rate, seed=args.seed,
+        known_place_ids=known_place_ids.sample(min(5000, len(known_place_ids)), random_state=args.seed).tolist(),
+    ))
+    vision_client = vision_stage.FakeVisionClient(latency=args.vision_latency * args.latency_scale)
+    vision_stage.set_client(vision_client)
+
+    areas = random.Random(args.seed).sample(zip_codes, min(args.areas, len(zip_codes)))
+    plan = plan_search(areas, ALL_ZIPS_RADIUS_M)
+    metrics.update(bench_search("cold", plan, index, args, trace_memory=True))
+    metrics["cold.fake_requests"] = sum(adapter.requests.values())
+    metrics["cold.vision_batches"] = vision_client.calls
+    metrics.update(bench_search("warm", plan, index, args))
+    metrics["process.max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    config = {key: value for key, value in vars(args).items() if key not in ("baseline", "update_baseline", "output")}
+    config["accounts"], config["zips"] = os.path.basename(args.accounts), os.path.basename(args.zips)
+    report = {"config": config, "metrics": {name: round(value, 4) for name, value in sorted(metrics.items())}}
+
+    width = max(map(len, report["metrics"]))
+    for name, value in report["metrics"].items():
+        print(f"{name:<{width}}  {value:>12,.3f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print("No baseline yet; run with --update-baseline to store one")
+        return 0
+    if baseline["config"] != config:
+        print("Note: baseline was recorded with different settings; comparisons may not be meaningful")
+    regressions = compare(report["metrics"], baseline["metrics"])
+    for name, old, new in regressions:
+        print(f"REGRESSION {name}: {old:,.3f} -> {new:,.3f}")
+    if not regressions:
+        print("No regressions against the baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
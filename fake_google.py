@@ -0,0 +1,260 @@
+# fake_google.py
+"""Offline stand-in for the Google Maps web services the app calls.
+
+FakeGoogleAdapter is a requests transport adapter that answers geocode, Text
+Search (with page tokens), Place Details and Place Photo requests from a
+generated, deterministic world: businesses sit on a 2 km grid, so overlapping
+search circles share places the way real ones do. Latency, error rates,
+per-second quotas and total request budgets are configurable.
+
+    adapter = FakeGoogleAdapter(latency={"textsearch": 0.15}, error_rate=0.01)
+    install(adapter)                      # every http_client request now hits the fake
+
+Setting RC_LEADS_FAKE_GOOGLE=1 makes http_client mount a default adapter on
+its own, so the whole app runs offline (pair it with RC_LEADS_FAKE_VISION=1).
+"""
+
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+# Mean simulated latency per endpoint, in seconds; each request varies by +/-50%
+DEFAULT_LATENCY = {"geocode": 0.03, "textsearch": 0.15, "details": 0.08, "photo": 0.06}
+
+# Text Search serves at most 3 pages of 20 results
+PAGE_SIZE = 20
+MAX_RESULTS = 60
+# Grid spacing of generated businesses, in degrees of latitude (about 2 km)
+CELL_DEGREES = 0.018
+
+NAME_WORDS = ["Truck", "ATV", "Auto", "Offroad", "Tire", "Install", "Performance", "Diesel", "Outfitters",
+              "Garage", "Motors", "Customs", "Accessories", "Parts", "Lift Kits", "Powersports", "Repair", "Supply"]
+STREETS = ["Main", "Oak", "Highway 30", "Commerce", "Industrial", "Market", "Ridge", "Lake", "Mill", "Cedar"]
+TYPES = ["car_repair", "car_dealer", "store", "hardware_store", "point_of_interest", "establishment"]
+
+
+def _hash(*parts):
+    return int(hashlib.sha256("|".join(map(str, parts)).encode()).hexdigest()[:15], 16)
+
+
+class FakeGoogleAdapter(BaseAdapter):
+    """Serves generated Maps API responses with simulated latency, errors and quotas.
+
+    `latency` overrides DEFAULT_LATENCY per endpoint. `error_rate` is the share
+    of requests answered with a retryable HTTP 500/503. `quota_qps` caps the
+    requests per second per endpoint (excess gets OVER_QUERY_LIMIT, or 429 for
+    photos), and `max_requests` is a total budget per endpoint after which every
+    request is over quota. Page tokens are rejected with INVALID_REQUEST if used
+    less than `token_delay` seconds after they were issued. A share
+    (`known_share`) of generated places reuse ids from `known_place_ids`, so
+    account matching has something to find.
+    """
+
+    def __init__(self, latency=None, error_rate=0.0, quota_qps=None, max_requests=None, token_delay=2.0,
+                 known_place_ids=(), known_share=0.1, photo_variants=64, seed=0):
+        super().__init__()
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.error_rate = error_rate
+        self.quota_qps = quota_qps or {}
+        self.max_requests = max_requests or {}
+        self.token_delay = token_delay
+        self.known_place_ids = list(known_place_ids)
+        self.known_share = known_share
+        self.photo_variants = photo_variants
+        self.seed = seed
+        self.requests = {}
+        self.statuses = {}
+        self._random = random.Random(seed)
+        self._recent = {}
+        self._tokens = {}
+        self._photos = {}
+        self._lock = threading.Lock()
+
+    # --- Transport ---
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        url = urlsplit(request.url)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        endpoint = self._endpoint(url.path)
+
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            delay = self.latency.get(endpoint, 0.0) * (0.5 + self._random.random())
+            failed = self._random.random() < self.error_rate
+            over_quota = self._over_quota(endpoint)
+        if delay:
+            time.sleep(delay)
+
+        if failed:
+            status, body = self._random.choice((500, 503)), {}
+        elif over_quota:
+            status, body = (429, {}) if endpoint == "photo" else (200, {"status": "OVER_QUERY_LIMIT", "results": []})
+        else:
+            status, body = self._handle(endpoint, params)
+        with self._lock:
+            key = body.get("status", status) if isinstance(body, dict) else status
+            self.statuses[(endpoint, key)] = self.statuses.get((endpoint, key), 0) + 1
+        return self._response(request, status, body)
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _endpoint(path):
+        for endpoint in ("geocode", "textsearch", "details", "photo"):
+            if f"/{endpoint}" in path:
+                return endpoint
+        return "unknown"
+
+    def _over_quota(self, endpoint):
+        budget = self.max_requests.get(endpoint)
+        if budget is not None and self.requests[endpoint] > budget:
+            return True
+        qps = self.quota_qps.get(endpoint)
+        if qps is None:
+            return False
+        now = time.monotonic()
+        recent = self._recent.setdefault(endpoint, deque())
+        while recent and now - recent[0] >= 1.0:
+            recent.popleft()
+        if len(recent) >= qps:
+            return True
+        recent.append(now)
+        return False
+
+    @staticmethod
+    def _response(request, status, body):
+        response = Response()
+        response.status_code = status
+        response.reason = "OK" if status == 200 else "Error"
+        response.request = request
+        response.url = request.url
+        if isinstance(body, bytes):
+            response._content = body
+            response.headers = CaseInsensitiveDict({"Content-Type": "image/jpeg"})
+        else:
+            response._content = json.dumps(body).encode()
+            response.headers = CaseInsensitiveDict({"Content-Type": "application/json; charset=UTF-8"})
+        response.encoding = "utf-8"
+        return response
+
+    # --- Fixtures ---
+    def _handle(self, endpoint, params):
+        if endpoint == "geocode":
+            return 200, self._geocode(params.get("address", ""))
+        if endpoint == "textsearch":
+            return 200, self._textsearch(params)
+        if endpoint == "details":
+            return 200, self._details(params.get("place_id", ""), params.get("fields"))
+        if endpoint == "photo":
+            return 200, self._photo(params.get("photoreference", ""))
+        return 404, {}
+
+    def _geocode(self, address):
+        # Anywhere in the lower 48, fixed per address
+        h = _hash(self.seed, "geo", address)
+        lat = 25.0 + (h % 24000) / 1000.0
+        lng = -124.0 + (h // 24000 % 57000) / 1000.0
+        return {"status": "OK", "results": [{"geometry": {
+            "location": {"lat": lat, "lng": lng},
+            "viewport": {"southwest": {"lat": lat - 0.05, "lng": lng - 0.06}, "northeast": {"lat": lat + 0.05, "lng": lng + 0.06}},
+        }}]}
+
+    def _places_near(self, query, lat, lng, radius):
+        """Generated businesses within `radius` metres, nearest first (at most MAX_RESULTS)."""
+        reach = min(radius, 15000) / 111320.0
+        lng_scale = max(math.cos(math.radians(lat)), 0.1)
+        places = []
+        for ix in range(math.floor((lat - reach) / CELL_DEGREES), math.floor((lat + reach) / CELL_DEGREES) + 1):
+            for iy in range(math.floor((lng - reach / lng_scale) / CELL_DEGREES), math.floor((lng + reach / lng_scale) / CELL_DEGREES) + 1):
+                for k in range(_hash(self.seed, ix, iy) % 4):
+                    h = _hash(self.seed, ix, iy, k)
+                    place_lat = (ix + (h % 1000) / 1000.0) * CELL_DEGREES
+                    place_lng = (iy + (h // 1000 % 1000) / 1000.0) * CELL_DEGREES
+                    distance = math.hypot(place_lat - lat, (place_lng - lng) * lng_scale) * 111320.0
+                    if distance <= radius:
+                        places.append((distance, ix, iy, k, h))
+        places.sort()
+        return [self._place(ix, iy, k, h) for _, ix, iy, k, h in places[:MAX_RESULTS]]
+
+    def _place(self, ix, iy, k, h):
+        if self.known_place_ids and h % 1000 < self.known_share * 1000:
+            place_id = self.known_place_ids[h % len(self.known_place_ids)]
+        else:
+            place_id = f"fake-{ix}-{iy}-{k}"
+        name = f"{NAME_WORDS[h % len(NAME_WORDS)]} {NAME_WORDS[h // 7 % len(NAME_WORDS)]}"
+        return {
+            "place_id": place_id, "name": name,
+            "formatted_address": f"{h % 9000 + 100} {STREETS[h // 11 % len(STREETS)]} St, Town, ST {h % 90000 + 10000:05d}, USA",
+            "types": [TYPES[h // 13 % len(TYPES)], "point_of_interest", "establishment"],
+        }
+
+    def _textsearch(self, params):
+        if "pagetoken" in params:
+            with self._lock:
+                issued = self._tokens.get(params["pagetoken"])
+            if issued is None or time.monotonic() - issued < self.token_delay:
+                return {"status": "INVALID_REQUEST", "results": []}
+            query, lat, lng, radius, page = json.loads(params["pagetoken"])
+        else:
+            lat, lng = map(float, params["location"].split(","))
+            query, radius, page = params.get("query", ""), float(params.get("radius", 5000)), 0
+
+        places = self._places_near(query, lat, lng, radius)
+        body = {"status": "OK" if places else "ZERO_RESULTS", "results": places[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]}
+        if (page + 1) * PAGE_SIZE < len(places):
+            token = json.dumps([query, lat, lng, radius, page + 1])
+            with self._lock:
+                self._tokens[token] = time.monotonic()
+            body["next_page_token"] = token
+        return body
+
+    def _details(self, place_id, fields=None):
+        h = _hash(self.seed, "details", place_id)
+        # Like Google, fields a place does not have are simply left out
+        result = {"place_id": place_id}
+        if h % 7:
+            result["formatted_phone_number"] = f"({h % 800 + 200}) 555-{h % 10000:04d}"
+        if h % 4:
+            result["photos"] = [{"photo_reference": f"{place_id}:{i}"} for i in range(h % 4)]
+        if h % 3:
+            result["website"] = f"https://example.com/{place_id}"
+        if h % 5 == 0:
+            result["editorial_summary"] = {"overview": "Truck accessories, lift kits and installation."}
+        if fields:
+            wanted = {"photos" if field == "photo" else field for field in fields.split(",")}
+            result = {key: value for key, value in result.items() if key in wanted}
+        return {"status": "OK", "result": result}
+
+    def _photo(self, photo_reference):
+        # A fixed set of distinct JPEGs, so image dedupe and Vision caching behave as with real photos
+        variant = _hash(self.seed, "photo", photo_reference) % self.photo_variants
+        with self._lock:
+            content = self._photos.get(variant)
+        if content is None:
+            from PIL import Image
+
+            image = Image.effect_noise((640, 480), 40 + variant).convert("RGB")
+            out = BytesIO()
+            image.save(out, "JPEG", quality=85)
+            content = out.getvalue()
+            with self._lock:
+                self._photos[variant] = content
+        return content
+
+
+def install(adapter, session=None):
+    """Routes every Maps API request of `session` (default: the shared http_client session) to `adapter`."""
+    import http_client
+
+    (session or http_client.get_session()).mount("https://maps.googleapis.com/", adapter)
+    return adapter
@@ -1,73 +1,131 @@
 # google_api_helpers.py (Updated Version)
 
-import requests
+import time
 import streamlit as st
 from io import BytesIO
 
-# Import the Vision client library and credentials helper
-from google.cloud import vision
-from google.oauth2 import service_account
+import http_client
+import api_cache
+from api_cache import cached, make_key
+from vision_stage import get_batcher
+from zip_centroids import get_table as get_centroid_table
 
 
 
-# --- Functions using API Key (No changes here) ---
-@st.cache_data
+# --- Functions using API Key (responses are kept in the shared on-disk cache) ---
+# All requests go through http_client, which pools connections, rate-limits per
+# endpoint, retries transient failures and raises http_client.ApiError otherwise.
 def geocode_zip(_api_key, zip_code):
-    # ... same as before ...
+    """Returns the centroid of a zip code or metro name, checking the offline table first."""
+    table = get_centroid_table()
+    location = table.lookup(zip_code)
+    if location:
+        return location
+
+    location = _geocode_remote(_api_key, zip_code)
+    if location:
+        table.add(zip_code, location['lat'], location['lng'], location.get('bounds'))
+    return location
+
+@cached("geocode")
+def _geocode_remote(_api_key, zip_code):
     endpoint_url = "https://maps.googleapis.com/maps/api/geocode/json"
     params = {'address': zip_code, 'key': _api_key}
-    response = requests.get(endpoint_url, params=params)
-    if response.status_code == 200:
-        results = response.json().get('results', [])
-        if results:
-            location = results[0]['geometry']['location']
-            return {'lat': location['lat'], 'lng': location['lng']}
+    response = http_client.get("geocode", endpoint_url, params)
+    results = response.json().get('results', [])
+    if results:
+        geometry = results[0]['geometry']
+        location = {'lat': geometry['location']['lat'], 'lng': geometry['location']['lng']}
+        viewport = geometry.get('viewport')
+        if viewport:
+            location['bounds'] = (viewport['southwest']['lat'], viewport['southwest']['lng'],
+                                  viewport['northeast']['lat'], viewport['northeast']['lng'])
+        return location
     return None
 
 
 
 # search_places function
 def search_places(api_key, query, location_lat, location_lng, radius_meters):
-    """Searches for places using keywords around a specific coordinate with a given radius."""
-    endpoint_url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
-
-    params = {
-        'query': query,
-        'location': f'{location_lat},{location_lng}',
-        'radius': radius_meters,  # Use the radius passed into the function
-        'key': api_key
-    }
-    response = requests.get(endpoint_url, params=params)
-    if response.status_code == 200:
-        return response.json().get('results', [])
-    return []
-
+    """Searches for places using keywords around a specific coordinate with a given radius (first page only)."""
+    return search_places_page(api_key, query, location_lat, location_lng, radius_meters)['results']
+
+# Pages are cached by their position, without their next_page_token: Google's tokens
+# expire within minutes, so only a page fetched just now can lead to the next one
+def search_places_page(api_key, query, location_lat, location_lng, radius_meters, page=0, page_token=None, fresh=False):
+    """Fetches one page (up to 20 results) of a Text Search.
+
+    Returns {'results', 'has_next_page', 'next_page_token', 'fetched_at'}.
+    'next_page_token' is only set on a page fetched from Google just now, and
+    becomes valid a couple of seconds after 'fetched_at'. Page 0 comes from
+    the cache unless `fresh`. A later page is fetched with `page_token` if
+    given; without one it can only come from the cache, and None is returned
+    on a miss.
+    """
+    key = make_key("search_places_page", query, location_lat, location_lng, radius_meters, page)
+    if not (fresh or page_token):
+        cached_page = api_cache.get("textsearch", key)
+        if cached_page is not None:
+            return dict(cached_page, next_page_token=None, fetched_at=None)
+        if page:
+            return None
 
+    endpoint_url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
 
-def get_place_details(api_key, place_id):
-    """Gets detailed information for a specific place."""
+    if page_token:
+        params = {'pagetoken': page_token, 'key': api_key}
+    else:
+        params = {
+            'query': query,
+            'location': f'{location_lat},{location_lng}',
+            'radius': radius_meters,  # Use the radius passed into the function
+            'key': api_key
+        }
+    response = http_client.get("textsearch", endpoint_url, params)
+    body = response.json()
+    result = {'results': body.get('results', []), 'has_next_page': bool(body.get('next_page_token'))}
+    api_cache.put("textsearch", key, result)
+    return dict(result, next_page_token=body.get('next_page_token'), fetched_at=time.time())
+
+
+
+# --- Field masks per pipeline stage ---
+# Everything the app shows or scores for a place
+PLACE_DETAILS_FIELDS = "name,formatted_address,formatted_phone_number,website,place_id,photo,editorial_summary,types"
+# Text Search already returns name, address, place_id and types, so enrichment only asks for the rest.
+# place_id (a Basic field) keeps the result non-empty, and so cacheable, for places with none of the others.
+ENRICHMENT_FIELDS = "place_id,formatted_phone_number,website,photo,editorial_summary"
+
+@cached("details")
+def get_place_details(api_key, place_id, fields=PLACE_DETAILS_FIELDS):
+    """Gets detailed information for a specific place, limited to the given field mask."""
     endpoint_url = "https://maps.googleapis.com/maps/api/place/details/json"
     
-    # NEW: Added 'editorial_summary' and 'types' to the fields we request
-    fields = "name,formatted_address,formatted_phone_number,website,place_id,photo,editorial_summary,types"
-    
     params = {
         'place_id': place_id,
         'fields': fields,
         'key': api_key
     }
-    response = requests.get(endpoint_url, params=params)
-    if response.status_code == 200:
-        return response.json().get('result', {})
-    return {}
+    response = http_client.get("details", endpoint_url, params)
+    return response.json().get('result', {})
 
-def get_place_photos(api_key, photo_reference, max_width=800):
-    # ... same as before ...
+def photo_key(photo_reference, max_width=800):
+    """The API cache key of a photo's bytes, which image_store also files its thumbnail under."""
+    # Same parts as the default key for _fetch_photo_bytes(api_key, ref, width), so cached photos stay valid
+    return make_key("_fetch_photo_bytes", (photo_reference, max_width), {})
+
+@cached("photo", key_func=lambda _api_key, photo_reference, max_width=800: photo_key(photo_reference, max_width))
+def _fetch_photo_bytes(api_key, photo_reference, max_width=800):
+    """Downloads the raw bytes of a Google Place photo."""
     endpoint_url = "https://maps.googleapis.com/maps/api/place/photo"
     params = { 'photoreference': photo_reference, 'maxwidth': max_width, 'key': api_key }
-    response = requests.get(endpoint_url, params=params)
-    if response.status_code == 200:
-        return BytesIO(response.content)
+    response = http_client.get("photo", endpoint_url, params, timeout=http_client.PHOTO_TIMEOUT)
+    return response.content
+
+def get_place_photos(api_key, photo_reference, max_width=800):
+    content = _fetch_photo_bytes(api_key, photo_reference, max_width)
+    if content:
+        return BytesIO(content)
     return None
     
 # NEW function to construct a photo URL
@@ -77,25 +135,14 @@ def get_photo_url(api_key, photo_reference, max_width=800):
     return f"https://maps.googleapis.com/maps/api/place/photo?maxwidth={max_width}&photoreference={photo_reference}&key={api_key}"
 
 
-# --- UPDATED FUNCTION using JSON Credentials ---
-@st.cache_data
+# --- Vision labels go through the shared, batched label stage ---
 def analyze_image_labels(image_content):
-    """Analyzes an image using the Google Cloud Vision client library and service account credentials."""
+    """Returns the Vision labels for an image, batched with other concurrent requests.
+
+    Results are keyed by a hash of the image, so the same photo is never labeled twice.
+    """
     try:
-        # Load credentials from Streamlit's secrets
-        creds = service_account.Credentials.from_service_account_info(st.secrets["gcp_service_account"])
-        client = vision.ImageAnnotatorClient(credentials=creds)
-
-        # Prepare the image for the API
-        image = vision.Image(content=image_content)
-
-        # Perform label detection
-        response = client.label_detection(image=image)
-        labels = response.label_annotations
-        
-        # Return a list of label descriptions
-        return [label.description.lower() for label in labels]
-        
+        return get_batcher().label(image_content)
     except Exception as e:
         st.error(f"Error with Vision API: {e}")
         return []
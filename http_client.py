@@ -0,0 +1,148 @@
+# http_client.py
+
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import instrumentation
+
+# Requests per second allowed for each endpoint in this process (override with RC_LEADS_RATE_<ENDPOINT>).
+# When several batch workers share one API key, give each a proportional share.
+DEFAULT_RATES = {"geocode": 40.0, "textsearch": 8.0, "details": 20.0, "photo": 20.0}
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (5, 20)
+PHOTO_TIMEOUT = (5, 30)
+
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_CAP_SECONDS = 30.0
+
+RETRY_HTTP_STATUSES = {429, 500, 502, 503, 504}
+# Google reports these inside a 200 response body
+RETRY_API_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+FATAL_API_STATUSES = {"REQUEST_DENIED", "INVALID_REQUEST"}
+
+POOL_SIZE = 64
+
+
+class ApiError(Exception):
+    """A Google API call that failed for good (after retries, or with a non-retryable status)."""
+
+    def __init__(self, endpoint, message):
+        super().__init__(f"{endpoint}: {message}")
+        self.endpoint = endpoint
+
+
+class TokenBucket:
+    """Thread-safe token bucket; `acquire` blocks until a request may be sent."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_session = None
+_buckets = {}
+_lock = threading.Lock()
+
+
+def get_session():
+    """Returns the process-wide keep-alive session shared by every helper."""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_SIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            if os.environ.get("RC_LEADS_FAKE_GOOGLE"):
+                # Offline stand-in for demos and benchmarks
+                from fake_google import FakeGoogleAdapter
+                _session.mount("https://maps.googleapis.com/", FakeGoogleAdapter())
+        return _session
+
+
+def get_bucket(endpoint):
+    with _lock:
+        if endpoint not in _buckets:
+            rate = float(os.environ.get(f"RC_LEADS_RATE_{endpoint.upper()}", DEFAULT_RATES.get(endpoint, 10.0)))
+            _buckets[endpoint] = TokenBucket(rate)
+        return _buckets[endpoint]
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _api_status(response):
+    if "json" not in response.headers.get("Content-Type", ""):
+        return None
+    try:
+        return response.json().get("status")
+    except ValueError:
+        return None
+
+
+def get(endpoint, url, params, timeout=DEFAULT_TIMEOUT):
+    """Sends a rate-limited GET with retries and returns the successful response.
+
+    Retries connection errors, timeouts, 429/5xx and OVER_QUERY_LIMIT with
+    jittered exponential backoff. Raises ApiError when retries run out or
+    Google rejects the request outright. Every attempt is recorded in
+    instrumentation; only a successful one counts as billed.
+    """
+    bucket = get_bucket(endpoint)
+    session = get_session()
+    problem = None
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(backoff_delay(attempt - 1))
+        bucket.acquire()
+        start = time.perf_counter()
+        try:
+            response = session.get(url, params=params, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            instrumentation.record_api(endpoint, time.perf_counter() - start, error=True)
+            problem = f"{type(e).__name__}: {e}"
+            continue
+
+        api_status = _api_status(response) if response.status_code == 200 else None
+        failed = response.status_code != 200 or api_status in RETRY_API_STATUSES | FATAL_API_STATUSES
+        instrumentation.record_api(endpoint, time.perf_counter() - start, error=failed,
+                                   nbytes=len(response.content), units=0 if failed else 1)
+
+        if response.status_code in RETRY_HTTP_STATUSES:
+            problem = f"HTTP {response.status_code}"
+            continue
+        if response.status_code != 200:
+            raise ApiError(endpoint, f"HTTP {response.status_code}")
+
+        if api_status in RETRY_API_STATUSES:
+            problem = api_status
+            continue
+        if api_status in FATAL_API_STATUSES:
+            raise ApiError(endpoint, f"{api_status}: {response.json().get('error_message', '')}".rstrip(": "))
+        return response
+
+    raise ApiError(endpoint, f"gave up after {MAX_RETRIES + 1} attempts ({problem})")
@@ -0,0 +1,135 @@
+# image_store.py
+
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import api_cache
+
+# Originals stay in the API cache's size-capped photo table, under the key results carry
+# (google_api_helpers.photo_key); only thumbnails are filed here, the first time each is shown
+IMAGE_DIR = os.environ.get("RC_LEADS_IMAGE_DIR", os.path.join(".cache", "images"))
+
+# Longest side of the thumbnails shown in result cards
+THUMBNAIL_SIZE = 300
+# Thumbnail bytes each session may keep in memory
+SESSION_MEMORY_BYTES = int(os.environ.get("RC_LEADS_SESSION_IMAGE_MB", "32")) * 1024 * 1024
+# Disk budget for thumbnails; oldest files are removed past it
+DISK_MAX_BYTES = int(os.environ.get("RC_LEADS_IMAGE_DISK_MB", "2048")) * 1024 * 1024
+PRUNE_EVERY = 200
+
+_saves = 0
+_saves_lock = threading.Lock()
+
+
+def _path(key, kind):
+    return os.path.join(IMAGE_DIR, kind, key[:2], f"{key}.jpg")
+
+
+def _write_atomic(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def make_thumbnail(content, size=THUMBNAIL_SIZE):
+    """Downscales an image to a small JPEG; returns None if the bytes are not a readable image."""
+    from PIL import Image
+
+    try:
+        with Image.open(BytesIO(content)) as img:
+            img.thumbnail((size, size))
+            out = BytesIO()
+            img.convert("RGB").save(out, "JPEG", quality=80)
+            return out.getvalue()
+    except Exception:
+        return None
+
+
+def _save_thumbnail(key, thumbnail):
+    global _saves
+    _write_atomic(_path(key, "thumbs"), thumbnail)
+    with _saves_lock:
+        _saves += 1
+        should_prune = _saves % PRUNE_EVERY == 0
+    if should_prune:
+        prune()
+
+
+def load_original(key):
+    """Reads a full-size photo from the API cache, or None if it has been evicted."""
+    return api_cache.get("photo", key, count=False)
+
+
+def load_thumbnail(key):
+    """Reads a thumbnail from disk, making it from the cached original the first time."""
+    try:
+        with open(_path(key, "thumbs"), "rb") as f:
+            return f.read()
+    except OSError:
+        original = load_original(key)
+        thumbnail = make_thumbnail(original) if original else None
+        if thumbnail:
+            _save_thumbnail(key, thumbnail)
+        return thumbnail
+
+
+def prune(max_bytes=None):
+    """Deletes the least recently modified thumbnails until the disk store fits its budget."""
+    max_bytes = DISK_MAX_BYTES if max_bytes is None else max_bytes
+    files = []
+    for root, _, names in os.walk(IMAGE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+class SessionImageStore:
+    """Per-session LRU of thumbnail bytes, capped at `max_bytes`.
+
+    Evicted thumbnails are simply re-read from disk the next time they are shown,
+    so memory stays flat no matter how many leads a session holds. Originals are
+    never held; they are read from the API cache when asked for.
+    """
+
+    def __init__(self, max_bytes=SESSION_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self._thumbnails = OrderedDict()
+        self._size = 0
+
+    def thumbnail(self, key):
+        if key in self._thumbnails:
+            self._thumbnails.move_to_end(key)
+            return self._thumbnails[key]
+
+        thumbnail = load_thumbnail(key)
+        if thumbnail:
+            self._thumbnails[key] = thumbnail
+            self._size += len(thumbnail)
+            while self._size > self.max_bytes and len(self._thumbnails) > 1:
+                _, evicted = self._thumbnails.popitem(last=False)
+                self._size -= len(evicted)
+        return thumbnail
+
+    def thumbnails(self, keys):
+        return [t for t in (self.thumbnail(key) for key in keys) if t]
+
+    def originals(self, keys):
+        return [o for o in (load_original(key) for key in keys) if o]
@@ -0,0 +1,212 @@
+# instrumentation.py
+"""Process-wide counters and latency histograms for API calls and pipeline stages.
+
+Two families are recorded:
+
+* api   - one entry per Google request (geocode, textsearch, details, photo)
+          and per Vision batch: latency, errors, bytes transferred and billed units.
+* stage - wall time of each pipeline step (search, details, photos, vision, ...).
+
+Cache hit rates come from api_cache. Counters are shared by every session and
+thread in the process; take a snapshot() before a run and diff() it afterwards
+for that run's numbers.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import api_cache
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, math.inf)
+
+# Estimated USD per 1000 billed units (requests; images for Vision). List prices
+# for the fields this app requests; override with RC_LEADS_PRICES='{"details": 20}'.
+PRICE_PER_1000 = {
+    "geocode": 5.0, "textsearch": 32.0, "details": 25.0, "photo": 7.0, "vision": 1.5,
+    **json.loads(os.environ.get("RC_LEADS_PRICES", "{}")),
+}
+
+_lock = threading.Lock()
+_metrics = {"api": {}, "stage": {}}
+# Raw latencies per (family, name), kept only while collect_samples() is active
+_samples = None
+
+
+def _new_stat():
+    return {"count": 0, "errors": 0, "seconds": 0.0, "bytes": 0, "units": 0, "buckets": [0] * len(LATENCY_BUCKETS)}
+
+
+def _record(family, name, seconds, error=False, nbytes=0, units=0):
+    with _lock:
+        stat = _metrics[family].get(name)
+        if stat is None:
+            stat = _metrics[family][name] = _new_stat()
+        stat["count"] += 1
+        stat["errors"] += bool(error)
+        stat["seconds"] += seconds
+        stat["bytes"] += nbytes
+        stat["units"] += units
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                stat["buckets"][i] += 1
+                break
+        if _samples is not None:
+            _samples.setdefault((family, name), []).append(seconds)
+
+
+def record_api(endpoint, seconds, error=False, nbytes=0, units=0):
+    """Records one API request; `units` is what Google bills for it (0 for a failed request)."""
+    _record("api", endpoint, seconds, error, nbytes, units)
+
+
+@contextmanager
+def stage(name):
+    """Times a block of pipeline work; an exception escaping it counts as an error."""
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        _record("stage", name, time.perf_counter() - start, error)
+
+
+@contextmanager
+def collect_samples():
+    """Keeps every latency recorded inside the block, for exact percentiles in benchmarks.
+
+    Yields a dict of (family, name) -> list of seconds.
+    """
+    global _samples
+    samples = {}
+    with _lock:
+        _samples = samples
+    try:
+        yield samples
+    finally:
+        with _lock:
+            _samples = None
+
+
+def snapshot():
+    """Copies the current counters, including api_cache hit/miss counts."""
+    with _lock:
+        data = {family: {name: dict(stat, buckets=list(stat["buckets"])) for name, stat in stats.items()}
+                for family, stats in _metrics.items()}
+    data["cache"] = api_cache.stats()
+    return data
+
+
+def diff(before, after=None):
+    """Counters accumulated between two snapshots (`after` defaults to now)."""
+    after = after or snapshot()
+    data = {}
+    for family in ("api", "stage"):
+        data[family] = {}
+        for name, stat in after[family].items():
+            old = before[family].get(name, _new_stat())
+            delta = {key: stat[key] - old[key] for key in ("count", "errors", "seconds", "bytes", "units")}
+            delta["buckets"] = [a - b for a, b in zip(stat["buckets"], old["buckets"])]
+            if delta["count"]:
+                data[family][name] = delta
+    data["cache"] = {}
+    for endpoint, counts in after["cache"].items():
+        old = before["cache"].get(endpoint, {"hits": 0, "misses": 0})
+        delta = {key: counts[key] - old[key] for key in ("hits", "misses")}
+        if delta["hits"] or delta["misses"]:
+            data["cache"][endpoint] = delta
+    return data
+
+
+def percentile(stat, q):
+    """Estimates a latency percentile (0-100) from the histogram: the bound of the bucket it falls in."""
+    if not stat["count"]:
+        return None
+    target = math.ceil(stat["count"] * q / 100)
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS, stat["buckets"]):
+        seen += count
+        if seen >= target:
+            return bound
+    return math.inf
+
+
+def estimated_cost(data):
+    """Estimated USD spent per endpoint (billed units x list price)."""
+    return {name: stat["units"] * PRICE_PER_1000.get(name, 0.0) / 1000 for name, stat in data["api"].items()}
+
+
+def summary_rows(data):
+    """One row per API endpoint and pipeline stage, for tables and logs."""
+    cost = estimated_cost(data)
+    rows = []
+    for family in ("api", "stage"):
+        for name, stat in sorted(data[family].items()):
+            cache = data["cache"].get(name) if family == "api" else None
+            lookups = cache["hits"] + cache["misses"] if cache else 0
+            rows.append({
+                "Kind": family, "Name": name, "Calls": stat["count"], "Errors": stat["errors"],
+                "Mean ms": round(1000 * stat["seconds"] / stat["count"], 1),
+                "p50 ms": _ms(percentile(stat, 50)), "p95 ms": _ms(percentile(stat, 95)),
+                "MB": round(stat["bytes"] / 1e6, 2),
+                "Cache hit %": round(100 * cache["hits"] / lookups, 1) if lookups else None,
+                "Est. $": round(cost[name], 3) if family == "api" else None,
+            })
+    return rows
+
+
+def _ms(seconds):
+    return None if seconds is None or math.isinf(seconds) else round(1000 * seconds)
+
+
+def to_json(data=None):
+    data = data or snapshot()
+    return json.dumps(dict(data, estimated_cost_usd=estimated_cost(data), latency_buckets=[str(b) for b in LATENCY_BUCKETS]), indent=2)
+
+
+def to_prometheus(data=None):
+    """Renders counters in the Prometheus text exposition format."""
+    data = data or snapshot()
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+
+    for family_name, label in (("api", "endpoint"), ("stage", "stage")):
+        stats = sorted(data[family_name].items())
+        prefix = f"rc_leads_{family_name}"
+        family(f"{prefix}_calls_total", "counter", f"Calls per {label}.",
+               [f'{prefix}_calls_total{{{label}="{n}"}} {s["count"]}' for n, s in stats])
+        family(f"{prefix}_errors_total", "counter", f"Failed calls per {label}.",
+               [f'{prefix}_errors_total{{{label}="{n}"}} {s["errors"]}' for n, s in stats])
+        samples = []
+        for n, s in stats:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, s["buckets"]):
+                cumulative += count
+                le = "+Inf" if math.isinf(bound) else bound
+                samples.append(f'{prefix}_seconds_bucket{{{label}="{n}",le="{le}"}} {cumulative}')
+            samples.append(f'{prefix}_seconds_sum{{{label}="{n}"}} {s["seconds"]:.6f}')
+            samples.append(f'{prefix}_seconds_count{{{label}="{n}"}} {s["count"]}')
+        family(f"{prefix}_seconds", "histogram", f"Latency per {label}.", samples)
+
+    api = sorted(data["api"].items())
+    family("rc_leads_api_bytes_total", "counter", "Response bytes downloaded per endpoint (image bytes sent, for Vision).",
+           [f'rc_leads_api_bytes_total{{endpoint="{n}"}} {s["bytes"]}' for n, s in api])
+    family("rc_leads_api_billed_units_total", "counter", "Billed requests (images for Vision) per endpoint.",
+           [f'rc_leads_api_billed_units_total{{endpoint="{n}"}} {s["units"]}' for n, s in api])
+    family("rc_leads_api_estimated_cost_usd_total", "counter", "Estimated spend per endpoint at list prices.",
+           [f'rc_leads_api_estimated_cost_usd_total{{endpoint="{n}"}} {c:.4f}' for n, c in sorted(estimated_cost(data).items())])
+    cache = sorted(data["cache"].items())
+    family("rc_leads_cache_lookups_total", "counter", "API cache lookups per endpoint and outcome.",
+           [f'rc_leads_cache_lookups_total{{endpoint="{n}",outcome="{o}"}} {c[o]}' for n, c in cache for o in ("hits", "misses")])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,98 @@
+# lead_ledger.py
+
+import json
+import os
+import time
+
+import local_store
+from local_store import DAY
+
+# One SQLite file shared by every Streamlit session and batch worker on the machine
+LEDGER_PATH = os.environ.get("RC_LEADS_LEDGER", os.path.join(".cache", "lead_ledger.sqlite"))
+
+# Stored results younger than this are reused instead of paying for details, photos and Vision again
+REUSE_MAX_AGE = int(os.environ.get("RC_LEADS_LEDGER_REUSE_DAYS", "30")) * DAY
+
+# Rows are looked up in chunks to stay under SQLite's bound-parameter limit
+LOOKUP_CHUNK = 500
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS leads ("
+    " place_id TEXT PRIMARY KEY, result TEXT NOT NULL,"
+    " account_type TEXT, account_confidence REAL, score INTEGER,"
+    " first_seen REAL NOT NULL, last_seen REAL NOT NULL, scored REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS leads_last_seen ON leads (last_seen)",
+)
+
+
+def get_connection():
+    """Returns this thread's connection to the ledger database, creating it if needed."""
+    return local_store.get_connection(LEDGER_PATH, SCHEMA)
+
+
+def lookup(place_ids):
+    """Returns {place_id: entry} for the places the ledger knows.
+
+    Each entry holds the stored 'result' and the 'first_seen', 'last_seen' and
+    'scored' timestamps.
+    """
+    conn = get_connection()
+    place_ids = list(place_ids)
+    entries = {}
+    for i in range(0, len(place_ids), LOOKUP_CHUNK):
+        chunk = place_ids[i:i + LOOKUP_CHUNK]
+        rows = conn.execute(
+            f"SELECT place_id, result, first_seen, last_seen, scored FROM leads"
+            f" WHERE place_id IN ({','.join('?' * len(chunk))})", chunk,
+        ).fetchall()
+        for place_id, result, first_seen, last_seen, scored in rows:
+            entries[place_id] = {
+                "result": json.loads(result), "first_seen": first_seen, "last_seen": last_seen, "scored": scored,
+            }
+    return entries
+
+
+def record(results, reused_place_ids=()):
+    """Upserts leads in one transaction and marks them seen now.
+
+    `first_seen` is kept from the existing row. For places in
+    `reused_place_ids` the result was served from the ledger, so `scored` is
+    kept too and the stored result does not get any fresher.
+    """
+    if not results:
+        return
+    now = time.time()
+    reused_place_ids = set(reused_place_ids)
+    rows = []
+    for result in results:
+        place_id = result['details']['place_id']
+        stored = {key: value for key, value in result.items() if key != 'first_seen'}
+        rows.append((
+            place_id, json.dumps(stored), result['account_type'], result.get('account_confidence'), result['score'],
+            now, now, 0 if place_id in reused_place_ids else now,
+        ))
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT INTO leads (place_id, result, account_type, account_confidence, score, first_seen, last_seen, scored)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (place_id) DO UPDATE SET result = excluded.result, account_type = excluded.account_type,"
+            " account_confidence = excluded.account_confidence, score = excluded.score, last_seen = excluded.last_seen,"
+            " scored = MAX(scored, excluded.scored)",
+            rows,
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def stats():
+    """Returns how many leads the ledger holds and how many were seen in the last day and week."""
+    now = time.time()
+    total, day, week = get_connection().execute(
+        "SELECT COUNT(*), COALESCE(SUM(last_seen >= ?), 0), COALESCE(SUM(last_seen >= ?), 0) FROM leads",
+        (now - DAY, now - 7 * DAY),
+    ).fetchone()
+    return {"leads": total, "seen_last_day": day, "seen_last_week": week}
@@ -0,0 +1,40 @@
+# local_store.py
+"""Helpers shared by the on-disk stores under .cache: SQLite connections and file signatures."""
+
+import os
+import sqlite3
+import threading
+
+DAY = 24 * 60 * 60
+
+_local = threading.local()
+
+
+def get_connection(path, schema=()):
+    """Returns this thread's connection to the SQLite database at `path`, creating it if needed.
+
+    The file is shared by every Streamlit session and worker process on the
+    machine. WAL lets them read while another writes; writers wait up to
+    `timeout` for the lock. The `schema` statements run once per connection.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in schema:
+            conn.execute(statement)
+        connections[path] = conn
+    return conn
+
+
+def file_signature(filename):
+    """Size and modification time of a file; whatever was compiled from it is rebuilt when either changes."""
+    stat = os.stat(filename)
+    return (stat.st_size, stat.st_mtime_ns)
@@ -0,0 +1,394 @@
+# pipeline.py
+
+import heapq
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from google_api_helpers import geocode_zip, search_places_page, get_place_details, get_place_photos, analyze_image_labels, get_photo_url, photo_key, ENRICHMENT_FIELDS
+from http_client import ApiError
+import instrumentation
+import lead_ledger
+from zip_centroids import get_table as get_centroid_table
+from search_planner import SearchedCircles
+from scorer import calculate_score
+
+# Number of requests each stage (area search, place details, photo download) may have in flight
+DEFAULT_CONCURRENCY = 8
+
+# Text Search returns at most 3 pages of 20 results per query
+MAX_PAGES = 3
+# A next_page_token is rejected (INVALID_REQUEST) if used sooner than this after its page
+PAGE_TOKEN_DELAY_SECONDS = 2.0
+# A circle's next page is only fetched if its last page brought at least this many
+# unseen places and this many leads that survived the exclusion filter
+NEXT_PAGE_MIN_NEW_PLACES = 5
+NEXT_PAGE_MIN_LEADS = 1
+# A circle's page n is read after the first pages of the next n * PAGE_ORDER_STRIDE circles,
+# a fixed spacing so the order of the results doesn't depend on the concurrency
+PAGE_ORDER_STRIDE = 8
+
+# Leads are written to the ledger in batches of this size
+LEDGER_FLUSH_EVERY = 50
+
+# How a run uses the lead ledger and what happens at the lead limit:
+#   use_ledger            reuse leads scored recently and record every lead returned
+#   skip_seen_days        leave out places the ledger saw within this many days...
+#   skip_seen_until       ...and before this timestamp, if given
+#   finish_started_areas  at max_locations, stop reading new circles and pages but still
+#                         process the places already claimed, so every started circle completes
+RunOptions = namedtuple(
+    "RunOptions", "use_ledger skip_seen_days skip_seen_until finish_started_areas",
+    defaults=(False, None, None, False),
+)
+
+
+def _search_circle(api_key, query, circle, page=0, page_token=None, location=None, searched=None, index=None):
+    """Returns one Text Search page for a planned circle, geocoding it first if needed.
+
+    The page dict also carries the circle's resolved 'location', which later
+    pages reuse, and the 'page' actually fetched. That is 0 instead of `page`
+    when `page` was not cached and there was no live token to fetch it with:
+    the chain then starts again from a fresh page 0. A first page is not
+    searched at all, and comes back empty and marked 'covered', when the circle
+    lies inside one of `searched` (a search_planner.SearchedCircles) that comes before
+    plan position `index`; otherwise the circle is added there.
+    """
+    if location is None:
+        location = {'lat': circle['lat'], 'lng': circle['lng']}
+        if location['lat'] is None:
+            with instrumentation.stage("geocode"):
+                location = geocode_zip(api_key, circle['label'])
+            if not location:
+                return {'results': [], 'has_next_page': False, 'next_page_token': None, 'page': page}
+        if searched is not None:
+            resolved = dict(circle, lat=location['lat'], lng=location['lng'])
+            if searched.covers(resolved, index):
+                return {'results': [], 'has_next_page': False, 'next_page_token': None, 'page': page,
+                        'location': location, 'covered': True}
+            searched.add(resolved, index)
+    lat, lng, radius = location['lat'], location['lng'], circle['radius']
+    with instrumentation.stage("search"):
+        result = search_places_page(api_key, query, lat, lng, radius, page, page_token)
+        if result is None:
+            page = 0
+            result = search_places_page(api_key, query, lat, lng, radius, 0, fresh=True)
+    return dict(result, location=location, page=page)
+
+
+def _submit_later(pool, delay, fn, *args):
+    """Like pool.submit, but only hands the task to the pool after `delay` seconds.
+
+    The wait happens on a timer thread, so no pool worker sits idle meanwhile.
+    """
+    if delay <= 0:
+        return pool.submit(fn, *args)
+    future = Future()
+
+    def copy_outcome(inner):
+        if future.cancelled():
+            return
+        if inner.cancelled():
+            future.cancel()
+        elif inner.exception() is not None:
+            future.set_exception(inner.exception())
+        else:
+            future.set_result(inner.result())
+
+    def submit():
+        if future.cancelled():
+            return
+        try:
+            pool.submit(fn, *args).add_done_callback(copy_outcome)
+        except RuntimeError:
+            # The pool was shut down while we waited
+            future.cancel()
+
+    timer = threading.Timer(delay, submit)
+    timer.daemon = True
+    timer.start()
+    return future
+
+
+def _process_place(api_key, query, place, account_type, account_confidence, photo_pool):
+    """Enriches one pre-filtered search result with details, photos and image labels, then scores it.
+
+    Only the fields Text Search does not already return (plus place_id) are
+    requested. Returns None when the details call comes back empty, i.e. the
+    place no longer exists.
+    """
+    with instrumentation.stage("place"):
+        return _enrich_place(api_key, query, place, account_type, account_confidence, photo_pool)
+
+
+def _enrich_place(api_key, query, place, account_type, account_confidence, photo_pool):
+    with instrumentation.stage("details"):
+        enrichment = get_place_details(api_key, place['place_id'], ENRICHMENT_FIELDS)
+    if not enrichment:
+        return None
+    details = {
+        'name': place.get('name'), 'formatted_address': place.get('formatted_address'),
+        'place_id': place['place_id'], 'types': place.get('types', []),
+        **enrichment,
+    }
+
+    # Download up to 3 photos in parallel; labels come from the first one that yields any
+    photo_refs = [p['photo_reference'] for p in details.get('photos', [])[:3]]
+    image_urls = [get_photo_url(api_key, ref) for ref in photo_refs]
+    photo_futures = [photo_pool.submit(get_place_photos, api_key, ref) for ref in photo_refs]
+    image_streams, image_refs = [], []
+    with instrumentation.stage("photos"):
+        for ref, future in zip(photo_refs, photo_futures):
+            # A photo that still fails after retries is skipped rather than losing the lead
+            try:
+                stream = future.result()
+            except ApiError:
+                continue
+            if stream:
+                image_streams.append(stream)
+                image_refs.append(ref)
+
+    image_labels = []
+    with instrumentation.stage("vision"):
+        for stream in image_streams:
+            image_labels = analyze_image_labels(stream.getvalue())
+            if image_labels:
+                break
+
+    with instrumentation.stage("score"):
+        score = calculate_score(details, image_labels, query)
+    # Photos stay in the API cache, and image_store makes thumbnails when shown; results only carry their keys
+    return {
+        "score": score, "details": details, "image_urls": image_urls,
+        "image_labels": list(set(image_labels)), "image_keys": [photo_key(ref) for ref in image_refs],
+        "account_type": account_type, "account_confidence": account_confidence,
+    }
+
+
+def _reuse_result(entry, query, account_type, account_confidence):
+    """Turns a ledger entry back into a result, with today's account status and tier."""
+    result = dict(entry['result'], account_type=account_type, account_confidence=account_confidence,
+                  first_seen=entry['first_seen'])
+    result['score'] = calculate_score(result['details'], result['image_labels'], query)
+    return result
+
+
+def result_to_record(result):
+    """Flattens a scored result into one row of the exported leads CSV."""
+    details = result['details']
+    image_urls = result['image_urls']
+    return {
+        "Name": details.get('name'),
+        "Account_Type": result['account_type'],
+        "Score": result['score'],
+        "Address": details.get('formatted_address'), "Phone": details.get('formatted_phone_number'),
+        "Website": details.get('website'), "PlaceID": details.get('place_id'),
+        "Description": details.get('editorial_summary', {}).get('overview', 'N/A'),
+        "Google_Types": ', '.join(details.get('types', [])), "Detected_Image_Keywords": ', '.join(result['image_labels']),
+        "Image_URL_1": image_urls[0] if len(image_urls) > 0 else None,
+        "Image_URL_2": image_urls[1] if len(image_urls) > 1 else None,
+        "Image_URL_3": image_urls[2] if len(image_urls) > 2 else None,
+    }
+
+
+def run_search(api_key, query, search_circles, max_locations, exclude_types,
+               account_index, concurrency=DEFAULT_CONCURRENCY, max_pages=MAX_PAGES,
+               on_area=None, on_result=None, on_area_done=None, on_error=None,
+               cancel_event=None, seen_place_ids=None, thread_initializer=None, options=RunOptions()):
+    """Runs the area -> place -> details -> photo pipeline over a search_planner plan.
+
+    Returns up to `max_locations` leads (see RunOptions.finish_started_areas), in
+    plan order and Text Search order whatever the concurrency, leaving out
+    places in `exclude_types` and `seen_place_ids` (which is updated in place).
+    `on_area(circle)` and `on_result(result)` are called from the calling thread
+    as circles are read and leads arrive. `on_area_done(circle, place_ids)` fires
+    in plan order once all of a circle's leads have gone through `on_result`; a
+    circle that failed with http_client.ApiError gets `on_error(circle, error)`
+    instead. Setting `cancel_event` stops the run with what has arrived so far.
+    """
+    concurrency = max(1, int(concurrency))
+    place_window = 2 * concurrency
+
+    area_pool = ThreadPoolExecutor(concurrency, thread_name_prefix="rc-area", initializer=thread_initializer)
+    place_pool = ThreadPoolExecutor(concurrency, thread_name_prefix="rc-place", initializer=thread_initializer)
+    photo_pool = ThreadPoolExecutor(concurrency, thread_name_prefix="rc-photo", initializer=thread_initializer)
+
+    circles = iter(search_circles)
+    # Heap of ((order, page, circle index), circle_state, future) search pages
+    area_futures = []
+    queued_circles = next_index = 0
+    place_futures = deque()
+    open_circles = deque()
+    all_results = []
+    found_place_ids = seen_place_ids if seen_place_ids is not None else set()
+    ledger_rows, reused_place_ids = [], set()
+    searched = SearchedCircles()
+    use_ledger, skip_seen_until = options.use_ledger, options.skip_seen_until
+    seen_cutoff = time.time() - options.skip_seen_days * lead_ledger.DAY if options.skip_seen_days else None
+
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    def next_page_future(circle, search_page):
+        # A live token must age before use; a cached page has none, so its successor comes from the cache.
+        # A successor that is neither cached nor reachable with a live token comes back as a
+        # fresh page 0, and the chain is walked again from there (see _search_circle)
+        page, page_token = search_page['page'] + 1, search_page['next_page_token']
+        delay = search_page['fetched_at'] + PAGE_TOKEN_DELAY_SECONDS - time.time() if page_token else 0
+        return _submit_later(area_pool, delay, _search_circle, api_key, query, circle, page, page_token, search_page['location'])
+
+    def queue_page(circle_state, page, future):
+        index = circle_state['index']
+        heapq.heappush(area_futures, ((index + page * PAGE_ORDER_STRIDE, page, index), circle_state, future))
+
+    def top_up_areas():
+        # First pages are searched up to `concurrency` circles ahead, and the next circle
+        # is always queued before a later page that sorts after it is read
+        nonlocal queued_circles, next_index
+        while queued_circles < concurrency or (area_futures and area_futures[0][0][0] >= next_index):
+            circle = next(circles, None)
+            if circle is None:
+                break
+            # 'pending' counts outstanding search pages and places; the circle is done at zero
+            circle_state = {'circle': circle, 'index': next_index, 'place_ids': [], 'pending': 1, 'failed': False, 'started': False}
+            open_circles.append(circle_state)
+            queue_page(circle_state, 0, area_pool.submit(
+                _search_circle, api_key, query, circle, searched=searched, index=next_index,
+            ))
+            queued_circles += 1
+            next_index += 1
+
+    try:
+        top_up_areas()
+        while not cancelled():
+            if len(all_results) >= max_locations:
+                if not options.finish_started_areas:
+                    break
+                if area_futures:
+                    # Claim nothing new: unstarted circles are left for a resume and
+                    # started ones end their pagination with the pages already read
+                    for _, circle_state, future in area_futures:
+                        future.cancel()
+                        if circle_state['started']:
+                            circle_state['pending'] -= 1
+                    area_futures.clear()
+                    started = [circle_state for circle_state in open_circles if circle_state['started']]
+                    open_circles.clear()
+                    open_circles.extend(started)
+
+            # Keep enough places in flight, pulling in the next search page as needed
+            while len(place_futures) < place_window and area_futures and len(all_results) < max_locations:
+                top_up_areas()
+                # Don't stall on a page still waiting for its token while places are ready
+                if place_futures and not area_futures[0][2].done():
+                    break
+                (_, page, _), circle_state, future = heapq.heappop(area_futures)
+                circle = circle_state['circle']
+                circle_state['started'] = True
+                if page == 0:
+                    queued_circles -= 1
+                top_up_areas()
+                if on_area and page == 0:
+                    on_area(circle)
+                circle_state['pending'] -= 1
+                try:
+                    search_page = future.result()
+                except ApiError as e:
+                    search_page = {'results': []}
+                    if page == 0:
+                        circle_state['failed'] = True
+                        if on_error:
+                            on_error(circle, e)
+
+                if search_page.get('page', page) < page:
+                    # A page fetched again only for its token; its places were read before
+                    if search_page['next_page_token']:
+                        circle_state['pending'] += 1
+                        queue_page(circle_state, page, next_page_future(circle, search_page))
+                    continue
+
+                new_places = []
+                for place in search_page['results']:
+                    if place['place_id'] not in found_place_ids:
+                        found_place_ids.add(place['place_id'])
+                        new_places.append(place)
+                circle_state['place_ids'].extend(p['place_id'] for p in new_places)
+
+                # Pre-filter on the search payload so excluded accounts cost nothing more
+                with instrumentation.stage("match_accounts"):
+                    account_matches = account_index.matches(new_places)
+                candidates = [
+                    (place, account_type, account_confidence)
+                    for place, (account_type, account_confidence) in zip(new_places, account_matches)
+                    if account_type not in exclude_types
+                ]
+                # Places the ledger scored recently are reused without API calls, and places it
+                # saw within skip_seen_days (and before skip_seen_until) are left out
+                known = {}
+                if use_ledger and candidates:
+                    with instrumentation.stage("ledger_lookup"):
+                        known = lead_ledger.lookup(place['place_id'] for place, _, _ in candidates)
+                leads = 0
+                for place, account_type, account_confidence in candidates:
+                    entry = known.get(place['place_id'])
+                    if (entry and seen_cutoff and entry['last_seen'] >= seen_cutoff
+                            and (skip_seen_until is None or entry['last_seen'] < skip_seen_until)):
+                        continue
+                    leads += 1
+                    circle_state['pending'] += 1
+                    if entry and time.time() - entry['scored'] <= lead_ledger.REUSE_MAX_AGE:
+                        # Already scored in an earlier run: no details, photo or Vision calls
+                        future = Future()
+                        future.set_result(_reuse_result(entry, query, account_type, account_confidence))
+                        reused_place_ids.add(place['place_id'])
+                    else:
+                        future = place_pool.submit(
+                            _process_place, api_key, query, place, account_type, account_confidence, photo_pool,
+                        )
+                    place_futures.append((circle_state, future))
+
+                # Only pay for the next page while this one was still productive; it is read
+                # behind the circles already prefetched, and one that fails just ends the pagination
+                if (search_page.get('has_next_page') and page + 1 < max_pages and not cancelled()
+                        and len(new_places) >= NEXT_PAGE_MIN_NEW_PLACES and leads >= NEXT_PAGE_MIN_LEADS):
+                    circle_state['pending'] += 1
+                    queue_page(circle_state, page + 1, next_page_future(circle, search_page))
+
+            if place_futures:
+                circle_state, future = place_futures.popleft()
+                circle_state['pending'] -= 1
+                try:
+                    result = future.result()
+                except ApiError as e:
+                    result = None
+                    circle_state['failed'] = True
+                    if on_error:
+                        on_error(circle_state['circle'], e)
+                if result:
+                    all_results.append(result)
+                    if use_ledger:
+                        ledger_rows.append(result)
+                        if len(ledger_rows) >= LEDGER_FLUSH_EVERY:
+                            lead_ledger.record(ledger_rows, reused_place_ids)
+                            ledger_rows.clear()
+                    if on_result:
+                        on_result(result)
+
+            while open_circles and open_circles[0]['pending'] == 0:
+                circle_state = open_circles.popleft()
+                if on_area_done and not circle_state['failed']:
+                    on_area_done(circle_state['circle'], circle_state['place_ids'])
+            if not place_futures and not area_futures:
+                break
+    finally:
+        # Drop any speculative work beyond max_locations; the photo pool goes last
+        # because running place tasks still submit downloads to it
+        area_pool.shutdown(wait=False, cancel_futures=True)
+        place_pool.shutdown(wait=True, cancel_futures=True)
+        photo_pool.shutdown(wait=True, cancel_futures=True)
+        # Persist any centroids geocoded during this run, and the leads not yet in the ledger
+        get_centroid_table().flush()
+        lead_ledger.record(ledger_rows, reused_place_ids)
+
+    return all_results
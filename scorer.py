@@ -1,39 +1,177 @@
 # scorer.py
 
+import json
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from local_store import file_signature
+
+RULES_PATH = os.environ.get("RC_LEADS_SCORING_RULES", "scoring_rules.json")
+
+# Text fields match a rule's keywords anywhere in the text; list fields match whole entries
+TEXT_FIELDS = ("name", "summary")
+LIST_FIELDS = ("types", "image_labels")
+
+# The original 10-point system, used when no rules file exists
+DEFAULT_RULES = {
+    "rules": [
+        {"name": "name keywords", "field": "name", "points": 5, "keywords": ["truck", "atv", "install", "installation"]},
+        {"name": "garage bay", "field": "image_labels", "points": 2,
+         "keywords": ["garage door", "automotive repair shop", "auto part", "vehicle repair", "service bay"]},
+        {"name": "trucks", "field": "image_labels", "points": 2,
+         "keywords": ["truck", "pickup truck", "commercial vehicle", "monster truck"]},
+        {"name": "showroom", "field": "image_labels", "points": 1,
+         "keywords": ["retail", "showroom", "display case", "store", "shelf", "merchandise"]},
+    ],
+    "tiers": [{"tier": 1, "min_score": 7}, {"tier": 2, "min_score": 4}],
+    "default_tier": 3,
+}
+
+
+class ScoringRules:
+    """Scoring rules compiled for fast matching.
+
+    Each rule adds its points once if any of its keywords matches its field.
+    Text-field keywords are compiled into one regular expression per rule and
+    list-field keywords into a set, so a lead is scored in a handful of
+    lookups however long the keyword lists grow. The raw score maps to the
+    first tier whose min_score it reaches (1=Top, 2=Mid, 3=Low by default).
+    """
+
+    def __init__(self, config, signature=None):
+        self.signature = signature
+        self.rules = []
+        for rule in config["rules"]:
+            field = rule["field"]
+            keywords = [str(k).lower() for k in rule["keywords"]]
+            if field in TEXT_FIELDS:
+                # Longest first, so overlapping keywords can't shadow each other
+                matcher = re.compile("|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True)))
+            elif field in LIST_FIELDS:
+                matcher = frozenset(keywords)
+            else:
+                raise ValueError(f"Rule {rule.get('name', field)!r} uses unknown field {field!r}")
+            self.rules.append((field, matcher, rule["points"]))
+        self.tiers = sorted(((t["min_score"], t["tier"]) for t in config["tiers"]), reverse=True)
+        self.default_tier = config["default_tier"]
+
+    @classmethod
+    def from_file(cls, path=RULES_PATH):
+        try:
+            with open(path) as f:
+                config = json.load(f)
+            signature = file_signature(path)
+        except FileNotFoundError:
+            config, signature = DEFAULT_RULES, None
+        return cls(config, signature)
+
+    def raw_score(self, place_details, image_labels):
+        values = {
+            "name": (place_details.get('name') or '').lower(),
+            "summary": ((place_details.get('editorial_summary') or {}).get('overview') or '').lower(),
+            "types": {t.lower() for t in place_details.get('types') or ()},
+            "image_labels": {label.lower() for label in image_labels or ()},
+        }
+        raw_score = 0
+        for field, matcher, points in self.rules:
+            if field in TEXT_FIELDS:
+                hit = matcher.search(values[field]) is not None
+            else:
+                hit = not matcher.isdisjoint(values[field])
+            if hit:
+                raw_score += points
+        return raw_score
+
+    def tier(self, raw_score):
+        for min_score, tier in self.tiers:
+            if raw_score >= min_score:
+                return tier
+        return self.default_tier
+
+    def score(self, place_details, image_labels):
+        return self.tier(self.raw_score(place_details, image_labels))
+
+    def score_frame(self, frame):
+        """Scores many leads at once.
+
+        `frame` has the columns name and summary (strings) and types and
+        image_labels (lists). Returns a DataFrame with raw_score and tier,
+        aligned with `frame`.
+        """
+        raw_score = pd.Series(0, index=frame.index)
+        for field, matcher, points in self.rules:
+            if field in TEXT_FIELDS:
+                hit = frame[field].fillna('').str.lower().str.contains(matcher)
+            else:
+                entries = frame[field].explode()
+                hit = entries.str.lower().isin(matcher).groupby(level=0).any()
+                hit = hit.reindex(frame.index, fill_value=False)
+            raw_score += hit.astype(int) * points
+        conditions = [raw_score >= min_score for min_score, _ in self.tiers]
+        tier = np.select(conditions, [tier for _, tier in self.tiers], default=self.default_tier) if conditions else self.default_tier
+        return pd.DataFrame({"raw_score": raw_score, "tier": tier}, index=frame.index)
+
+
+_rules = None
+_rules_lock = threading.Lock()
+
+
+def get_rules(path=RULES_PATH):
+    """Returns the compiled rules, recompiling them when the rules file changes."""
+    global _rules
+    try:
+        signature = file_signature(path)
+    except FileNotFoundError:
+        signature = None
+    with _rules_lock:
+        if _rules is None or _rules.signature != signature:
+            _rules = ScoringRules.from_file(path)
+        return _rules
+
+
 def calculate_score(place_details, image_labels, user_query):
     """
-    Calculates a raw score based on a custom 10-point system,
+    Calculates a raw score from the configured rules,
     then converts it to a tiered score (1=Top, 2=Mid, 3=Low).
     """
-    raw_score = 0
-    
-    # --- 1. Name Analysis (Max 5 points) ---
-    name_keywords = ['truck', 'atv', 'install', 'installation']
-    place_name = place_details.get('name', '').lower()
-
-    if any(keyword in place_name for keyword in name_keywords):
-        raw_score += 5
-
-    # --- 2. Image Analysis (Max 5 points) ---
-    if image_labels:
-        garage_bay_labels = ['garage door', 'automotive repair shop', 'auto part', 'vehicle repair', 'service bay']
-        truck_labels = ['truck', 'pickup truck', 'commercial vehicle', 'monster truck']
-        showroom_labels = ['retail', 'showroom', 'display case', 'store', 'shelf', 'merchandise']
-
-        if any(label in image_labels for label in garage_bay_labels):
-            raw_score += 2
-        
-        if any(label in image_labels for label in truck_labels):
-            raw_score += 2
-
-        if any(label in image_labels for label in showroom_labels):
-            raw_score += 1
-            
-    # --- 3. Convert Raw Score to Final Tier ---
-    if raw_score >= 7:
-        return 1  # Top Tier
-    elif raw_score >= 4:
-        return 2  # Mid Tier
-    else:
-        return 3  # Low Tier
+    return get_rules().score(place_details, image_labels)
+
+
+def results_frame(results):
+    """Builds the score_frame input from pipeline results."""
+    return pd.DataFrame({
+        "name": [r['details'].get('name') for r in results],
+        "summary": [(r['details'].get('editorial_summary') or {}).get('overview') for r in results],
+        "types": [r['details'].get('types') or [] for r in results],
+        "image_labels": [r['image_labels'] for r in results],
+    })
+
+
+def records_frame(records):
+    """Builds the score_frame input from exported leads CSV rows."""
+    def split(column):
+        return records[column].fillna('').map(lambda text: [v for v in text.split(', ') if v])
+
+    return pd.DataFrame({
+        "name": records["Name"],
+        "summary": records["Description"].where(records["Description"] != 'N/A'),
+        "types": split("Google_Types"),
+        "image_labels": split("Detected_Image_Keywords"),
+    }, index=records.index)
+
 
+def rescore(results, rules=None):
+    """Re-tiers pipeline results in place with the current rules; returns how many changed tier."""
+    if not results:
+        return 0
+    tiers = (rules or get_rules()).score_frame(results_frame(results))["tier"]
+    changed = 0
+    for result, tier in zip(results, tiers):
+        if result['score'] != tier:
+            result['score'] = int(tier)
+            changed += 1
+    return changed
@@ -0,0 +1,187 @@
+# search_planner.py
+
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+from zip_centroids import get_table as get_centroid_table
+
+M_PER_DEG_LAT = 111320.0
+EARTH_RADIUS_M = 6371000.0
+
+# Search radius for each search mode, in meters
+METRO_RADIUS_M = 40000
+ZIP_RADIUS_M = 11265
+ALL_ZIPS_RADIUS_M = 5000
+
+# Areas are only merged into a circle whose center is within this share of the radius
+# of their centroid, so each keeps at least half its own search radius around it
+MERGE_WITHIN = 0.5
+
+
+def distance_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in meters; accepts scalars or broadcastable arrays."""
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _grid_cells(lats, lngs, radius):
+    """Buckets points into square cells whose half-diagonal equals `radius`.
+
+    Rows are bands of latitude; each row uses its own meters-per-degree of
+    longitude, so cells stay square from Florida to Alaska.
+    """
+    side = radius * np.sqrt(2)
+    rows = np.floor(lats * M_PER_DEG_LAT / side).astype(np.int64)
+    row_lats = (rows + 0.5) * side / M_PER_DEG_LAT
+    m_per_deg_lng = M_PER_DEG_LAT * np.cos(np.radians(row_lats))
+    cols = np.floor(lngs * m_per_deg_lng / side).astype(np.int64)
+    _, cell_of_point = np.unique(np.stack([rows, cols], axis=1), axis=0, return_inverse=True)
+    return cell_of_point.ravel()
+
+
+def _circle_index(lats, lngs, radius):
+    """Coarse lat/lng buckets at least 2 * radius wide, for finding nearby circles."""
+    lat_step = 2 * radius / M_PER_DEG_LAT
+    lng_step = 2 * radius / (M_PER_DEG_LAT * np.cos(np.radians(min(np.abs(lats).max(), 85.0))))
+    keys = list(zip(np.floor(lats / lat_step).astype(int), np.floor(lngs / lng_step).astype(int)))
+    index = defaultdict(list)
+    for i, key in enumerate(keys):
+        index[key].append(i)
+    return keys, index
+
+
+def cover_points(labels, lats, lngs, radius):
+    """Computes a small set of circles of `radius` meters that covers every point with margin.
+
+    Points are bucketed into a grid, each occupied cell gets one circle centered
+    on its points' bounding box, and circles whose points are all within
+    MERGE_WITHIN * radius of other circles' centers are then dropped. Returns
+    circle dicts in the order of `labels`.
+    """
+    lats, lngs = np.asarray(lats, dtype=float), np.asarray(lngs, dtype=float)
+    if len(lats) == 0:
+        return []
+
+    reach = MERGE_WITHIN * radius
+    cells = _grid_cells(lats, lngs, reach)
+    n_cells = cells.max() + 1
+    members = [[] for _ in range(n_cells)]
+    for point, cell in enumerate(cells):
+        members[cell].append(point)
+
+    centers_lat = np.array([(lats[m].min() + lats[m].max()) / 2 for m in members])
+    centers_lng = np.array([(lngs[m].min() + lngs[m].max()) / 2 for m in members])
+
+    # Greedily drop redundant circles, smallest first, reassigning their points
+    keys, index = _circle_index(centers_lat, centers_lng, radius)
+    owned = [list(m) for m in members]
+    alive = np.ones(n_cells, dtype=bool)
+    for cell in sorted(range(n_cells), key=lambda c: len(members[c])):
+        row, col = keys[cell]
+        neighbors = np.array([
+            other for dr in (-1, 0, 1) for dc in (-1, 0, 1)
+            for other in index.get((row + dr, col + dc), ()) if other != cell and alive[other]
+        ], dtype=int)
+        if len(neighbors) == 0:
+            continue
+        points = np.array(owned[cell])
+        d = distance_m(lats[points][:, None], lngs[points][:, None], centers_lat[neighbors][None, :], centers_lng[neighbors][None, :])
+        inside = d <= reach
+        if inside.any(axis=1).all():
+            new_owner = neighbors[inside.argmax(axis=1)]
+            for point, owner in zip(points, new_owner):
+                owned[owner].append(point)
+            owned[cell] = []
+            alive[cell] = False
+
+    circles = []
+    for cell in np.flatnonzero(alive):
+        points = sorted(owned[cell])
+        areas = [labels[p] for p in points]
+        circles.append({
+            "label": areas[0] if len(areas) == 1 else f"{areas[0]} (+{len(areas) - 1} more)",
+            "lat": round(float(centers_lat[cell]), 5), "lng": round(float(centers_lng[cell]), 5),
+            "radius": radius, "areas": areas, "_first": points[0],
+        })
+    circles.sort(key=lambda c: c.pop("_first"))
+    return circles
+
+
+class SearchedCircles:
+    """Circles already searched, to skip new circles that lie entirely inside one.
+
+    Circles are added with their position in the current plan (-1 for circles
+    searched before it), and a circle only counts as covered by circles that
+    come before it. Safe to use from several threads.
+    """
+
+    def __init__(self, circles=()):
+        circles = list(circles)
+        self._lock = threading.Lock()
+        # Rows are only ever appended, and growing swaps in a new array, so a
+        # reader can use the first `count` rows of a snapshot without the lock
+        self._rows = np.empty((max(len(circles), 64), 4))
+        self._count = 0
+        for circle in circles:
+            self.add(circle)
+
+    def add(self, circle, index=-1):
+        if circle["lat"] is None:
+            return
+        with self._lock:
+            if self._count == len(self._rows):
+                self._rows = np.concatenate([self._rows, np.empty_like(self._rows)])
+            self._rows[self._count] = (circle["lat"], circle["lng"], circle["radius"], index)
+            self._count += 1
+
+    def covers(self, circle, index=None):
+        """True if `circle` lies inside a circle added before it in the plan."""
+        if circle["lat"] is None:
+            return False
+        with self._lock:
+            rows, count = self._rows, self._count
+        lats, lngs, radii, order = rows[:count].T
+        candidates = radii >= circle["radius"]
+        if index is not None:
+            candidates &= order < index
+        if not candidates.any():
+            return False
+        d = distance_m(circle["lat"], circle["lng"], lats[candidates], lngs[candidates])
+        return bool((d + circle["radius"] <= radii[candidates]).any())
+
+
+def plan_search(areas, radius, covered=(), table=None):
+    """Plans the search circles for a list of zip codes or metro names.
+
+    Areas with a known centroid are merged into covering circles; areas not in
+    the centroid table yet get one circle each with lat/lng None, to be
+    geocoded when the circle is searched. Repeated areas and circles inside any
+    of `covered` (e.g. circles already searched for this query) are skipped.
+    """
+    table = table or get_centroid_table()
+    areas = list(dict.fromkeys(areas))
+    lats, lngs = table.lookup_many(areas)
+    known = ~np.isnan(lats)
+
+    known_areas = [area for area, k in zip(areas, known) if k]
+    circles = cover_points(known_areas, lats[known], lngs[known], radius)
+    circles += [
+        {"label": area, "lat": None, "lng": None, "radius": radius, "areas": [area]}
+        for area, k in zip(areas, known) if not k
+    ]
+
+    searched = SearchedCircles(covered)
+    return [circle for circle in circles if not searched.covers(circle)]
+
+
+def plan_summary(plan):
+    """Returns the expected number of API calls a plan needs before any place lookups."""
+    geocodes = sum(1 for circle in plan if circle["lat"] is None)
+    return {
+        "areas": sum(len(circle["areas"]) for circle in plan),
+        "searches": len(plan),
+        "geocodes": geocodes,
+    }
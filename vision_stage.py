@@ -0,0 +1,232 @@
+# vision_stage.py
+
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import api_cache
+import instrumentation
+
+# Vision accepts at most 16 images per batch_annotate_images request
+MAX_BATCH_SIZE = 16
+# How long a partial batch waits for more images before it is sent anyway
+MAX_BATCH_WAIT_SECONDS = 0.05
+# Batches allowed in flight at once
+MAX_CONCURRENT_BATCHES = 4
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def content_key(image_content):
+    """Cache key for an image: the SHA-256 of its bytes, so identical photos share labels."""
+    return hashlib.sha256(image_content).hexdigest()
+
+
+def _create_client():
+    """Builds the real Vision client from Streamlit secrets, or default credentials when headless."""
+    if os.environ.get("RC_LEADS_FAKE_VISION"):
+        return FakeVisionClient()
+
+    from google.cloud import vision
+    from google.oauth2 import service_account
+
+    try:
+        import streamlit as st
+        info = st.secrets["gcp_service_account"]
+    except Exception:
+        info = None
+    if info:
+        creds = service_account.Credentials.from_service_account_info(info)
+        return vision.ImageAnnotatorClient(credentials=creds)
+    return vision.ImageAnnotatorClient()
+
+
+def get_client():
+    """Returns the process-wide Vision client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = _create_client()
+        return _client
+
+
+def set_client(client):
+    """Replaces the process-wide Vision client (e.g. with a FakeVisionClient)."""
+    global _client, _batcher
+    with _client_lock:
+        _client = client
+    with _batcher_lock:
+        _batcher = None
+
+
+def _build_requests(contents):
+    from google.cloud import vision
+
+    feature = vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION)
+    return [vision.AnnotateImageRequest(image=vision.Image(content=c), features=[feature]) for c in contents]
+
+
+def annotate_batch(client, contents):
+    """Labels up to MAX_BATCH_SIZE images in one request; returns one label list (or exception) per image."""
+    if isinstance(client, FakeVisionClient):
+        requests = [FakeRequest(content) for content in contents]
+    else:
+        requests = _build_requests(contents)
+    response = client.batch_annotate_images(requests=requests)
+
+    results = []
+    for image_response in response.responses:
+        if image_response.error.message:
+            results.append(RuntimeError(image_response.error.message))
+        else:
+            results.append([label.description.lower() for label in image_response.label_annotations])
+    return results
+
+
+class LabelBatcher:
+    """Collects label requests from many threads and sends them as batched Vision calls.
+
+    Requests for an image already labeled (in the shared cache) or already in
+    flight are answered without another API call.
+    """
+
+    def __init__(self, client=None, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_BATCH_WAIT_SECONDS):
+        self._client = client
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._lock = threading.Condition()
+        self._queue = []
+        self._in_flight = {}
+        self._senders = ThreadPoolExecutor(MAX_CONCURRENT_BATCHES, thread_name_prefix="rc-vision")
+        self._flusher = threading.Thread(target=self._run, name="rc-vision-batcher", daemon=True)
+        self._flusher.start()
+
+    def submit(self, image_content):
+        """Returns a Future that resolves to the image's lowercase label descriptions."""
+        key = content_key(image_content)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future
+
+        labels = api_cache.get("vision", key)
+        future = Future()
+        if labels is not None:
+            future.set_result(labels)
+            return future
+
+        with self._lock:
+            # Another thread may have queued the same image while we checked the cache
+            if key in self._in_flight:
+                return self._in_flight[key]
+            self._in_flight[key] = future
+            self._queue.append((key, image_content))
+            self._lock.notify()
+        return future
+
+    def label(self, image_content):
+        return self.submit(image_content).result()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._queue:
+                    self._lock.wait()
+                # Give a partial batch a moment to fill up
+                deadline = time.monotonic() + self.max_wait
+                while len(self._queue) < self.max_batch_size and time.monotonic() < deadline:
+                    self._lock.wait(deadline - time.monotonic())
+                batch, self._queue = self._queue[:self.max_batch_size], self._queue[self.max_batch_size:]
+            self._senders.submit(self._send, batch)
+
+    def _send(self, batch):
+        start = time.perf_counter()
+        try:
+            results = annotate_batch(self._client or get_client(), [content for _, content in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        # Vision bills per image; a failed image is not billed
+        labeled = sum(not isinstance(result, Exception) for result in results)
+        instrumentation.record_api("vision", time.perf_counter() - start, error=labeled < len(batch),
+                                   nbytes=sum(len(content) for _, content in batch), units=labeled)
+
+        for (key, _), result in zip(batch, results):
+            # Cache before leaving the in-flight table so a concurrent submit never misses both
+            if not isinstance(result, Exception):
+                api_cache.put("vision", key, result)
+            with self._lock:
+                future = self._in_flight.pop(key)
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    """Returns the process-wide LabelBatcher."""
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = LabelBatcher()
+        return _batcher
+
+
+# --- Offline stand-in for tests and benchmarks ---
+class _Obj:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class FakeRequest:
+    def __init__(self, content):
+        self.image = _Obj(content=content)
+
+
+class FakeVisionClient:
+    """Mimics ImageAnnotatorClient.batch_annotate_images without network access.
+
+    Labels come from `labels_by_key` (content hash -> labels) or, failing that,
+    are derived deterministically from the image bytes.
+    """
+
+    VOCABULARY = ["truck", "pickup truck", "garage door", "auto part", "retail", "store", "tire", "building", "car", "shelf"]
+
+    def __init__(self, labels_by_key=None, latency=0.0, error_rate=0.0):
+        self.labels_by_key = labels_by_key or {}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self.images = 0
+        self._lock = threading.Lock()
+
+    def _labels_for(self, content):
+        key = content_key(content)
+        if key in self.labels_by_key:
+            return self.labels_by_key[key]
+        seed = int(key[:8], 16)
+        return [word for i, word in enumerate(self.VOCABULARY) if (seed >> i) & 1]
+
+    def batch_annotate_images(self, requests=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.images += len(requests)
+        if self.latency:
+            time.sleep(self.latency)
+
+        responses = []
+        for request in requests:
+            content = request.image.content
+            failed = self.error_rate and int(content_key(content)[8:16], 16) / 0xFFFFFFFF < self.error_rate
+            labels = [] if failed else self._labels_for(content)
+            responses.append(_Obj(
+                label_annotations=[_Obj(description=label.title()) for label in labels],
+                error=_Obj(message="fake Vision error" if failed else ""),
+            ))
+        return _Obj(responses=responses)
@@ -0,0 +1,208 @@
+# zip_centroids.py
+"""Offline lookup table of search-area centroids (zip codes and metro names).
+
+The table is a sorted NumPy structured array saved as a .npy file and opened
+memory-mapped, so lookups are a binary search over pages the OS already has
+cached. Misses geocoded over the network are written back in batches.
+
+The first time it is opened, it is built from the lat/lng columns in zips.csv
+(zip centroids from GeoNames, geonames.org, CC BY 4.0). It can also be
+rebuilt from the Census ZCTA gazetteer, or any CSV with zipcode, lat, lng:
+
+    python zip_centroids.py 2023_Gaz_zcta_national.txt
+"""
+
+import atexit
+import os
+import sys
+import threading
+
+import numpy as np
+
+CENTROIDS_PATH = os.environ.get("RC_LEADS_CENTROIDS", os.path.join(".cache", "centroids.npy"))
+# Shipped zip centroids the table is built from when it does not exist yet
+SEED_PATH = os.environ.get("RC_LEADS_CENTROID_SEED", "zips.csv")
+
+KEY_BYTES = 64
+CENTROID_DTYPE = np.dtype([
+    ("key", f"S{KEY_BYTES}"), ("lat", "f8"), ("lng", "f8"),
+    # Bounding box from the geocoder's viewport; NaN when unknown
+    ("south", "f8"), ("west", "f8"), ("north", "f8"), ("east", "f8"),
+])
+
+# Write-backs are batched so a sweep does not rewrite the file on every miss
+FLUSH_EVERY = 100
+
+
+def _encode_key(area):
+    return str(area).strip().lower().encode("utf-8")
+
+
+class CentroidTable:
+    """Memory-mapped area -> centroid table with batched write-back."""
+
+    def __init__(self, path=CENTROIDS_PATH, seed=SEED_PATH):
+        self.path = path
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._table = self._load()
+
+    def _load(self):
+        table = _read_table(self.path)
+        if table is None and self.seed and os.path.exists(self.seed):
+            table = write_table(self.path, read_centroids(self.seed))
+        return table if table is not None else np.empty(0, dtype=CENTROID_DTYPE)
+
+    def __len__(self):
+        return len(self._table) + len(self._pending)
+
+    def _row_to_location(self, row):
+        location = {"lat": float(row["lat"]), "lng": float(row["lng"])}
+        if not np.isnan(row["south"]):
+            location["bounds"] = (float(row["south"]), float(row["west"]), float(row["north"]), float(row["east"]))
+        return location
+
+    def lookup(self, area):
+        """Returns {'lat', 'lng'[, 'bounds']} for an area, or None if it is not in the table."""
+        key = _encode_key(area)
+        with self._lock:
+            row = self._pending.get(key)
+            table = self._table
+        if row is not None:
+            return self._row_to_location(row)
+
+        index = np.searchsorted(table["key"], key)
+        if index < len(table) and table["key"][index] == key:
+            return self._row_to_location(table[index])
+        return None
+
+    def lookup_many(self, areas):
+        """Vectorized lookup; returns (lats, lngs) arrays with NaN for areas not in the table."""
+        keys = np.array([_encode_key(area) for area in areas], dtype=f"S{KEY_BYTES}")
+        lats = np.full(len(keys), np.nan)
+        lngs = np.full(len(keys), np.nan)
+        table = self._table
+        if len(table) and len(keys):
+            index = np.minimum(np.searchsorted(table["key"], keys), len(table) - 1)
+            found = table["key"][index] == keys
+            lats[found] = table["lat"][index[found]]
+            lngs[found] = table["lng"][index[found]]
+        with self._lock:
+            pending = dict(self._pending)
+        for i, key in enumerate(keys):
+            row = pending.get(key)
+            if row is not None:
+                lats[i], lngs[i] = row["lat"], row["lng"]
+        return lats, lngs
+
+    def add(self, area, lat, lng, bounds=None):
+        """Queues a geocoded area for the next write-back."""
+        key = _encode_key(area)
+        if len(key) > KEY_BYTES:
+            return
+        row = np.zeros((), dtype=CENTROID_DTYPE)
+        row["key"], row["lat"], row["lng"] = key, lat, lng
+        row["south"], row["west"], row["north"], row["east"] = bounds if bounds else (np.nan,) * 4
+        with self._lock:
+            self._pending[key] = row
+            should_flush = len(self._pending) >= FLUSH_EVERY
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """Merges queued rows into the file on disk and re-maps it."""
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            # Re-read the file so rows written by other processes are kept
+            current = self._load()
+            self._table = write_table(self.path, np.concatenate([current, np.array(list(pending.values()), dtype=CENTROID_DTYPE)]))
+
+
+def _read_table(path):
+    """Memory-maps the table file, or returns None if it is missing or damaged."""
+    if os.path.exists(path):
+        try:
+            return np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            pass  # A damaged table is rebuilt from the seed or the next write-back
+    return None
+
+
+def write_table(path, rows):
+    """Sorts and de-duplicates rows (later rows win), then atomically replaces the table file."""
+    rows = np.asarray(rows, dtype=CENTROID_DTYPE)
+    # np.unique keeps the first occurrence, so reverse to let newer rows win
+    _, first = np.unique(rows["key"][::-1], return_index=True)
+    rows = rows[::-1][first]
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, rows)
+    os.replace(tmp_path, path)
+    return np.load(path, mmap_mode="r")
+
+
+def load_zip_codes(filename="zips.csv"):
+    """Returns the sorted zip codes from zips.csv as 5-character strings (leading zeros kept)."""
+    import pandas as pd
+
+    try:
+        df = pd.read_csv(filename, usecols=["zipcode"], dtype={"zipcode": str})
+    except FileNotFoundError:
+        return []
+    return sorted(df["zipcode"].str.strip().str.zfill(5).tolist())
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_table():
+    """Returns the process-wide centroid table, memory-mapping it on first use."""
+    global _table
+    with _table_lock:
+        if _table is None:
+            _table = CentroidTable()
+            atexit.register(_table.flush)
+        return _table
+
+
+def read_centroids(source):
+    """Reads centroid rows from a Census ZCTA gazetteer file or a zipcode,lat,lng CSV, skipping blanks."""
+    import pandas as pd
+
+    sep = "\t" if source.endswith(".txt") else ","
+    df = pd.read_csv(source, sep=sep, dtype=str)
+    df.columns = [c.strip().upper() for c in df.columns]
+    if "GEOID" in df.columns:
+        df = df.rename(columns={"GEOID": "ZIPCODE", "INTPTLAT": "LAT", "INTPTLONG": "LNG"})
+    df = df.dropna(subset=["ZIPCODE", "LAT", "LNG"])
+
+    rows = np.zeros(len(df), dtype=CENTROID_DTYPE)
+    rows["key"] = df["ZIPCODE"].str.strip().str.zfill(5).str.encode("utf-8").to_numpy(dtype=f"S{KEY_BYTES}")
+    rows["lat"] = df["LAT"].astype(float).to_numpy()
+    rows["lng"] = df["LNG"].astype(float).to_numpy()
+    for field in ("south", "west", "north", "east"):
+        rows[field] = np.nan
+    return rows
+
+
+def build_from_file(source, path=CENTROIDS_PATH):
+    """Builds the table from a Census ZCTA gazetteer file or a zipcode,lat,lng CSV."""
+    rows = read_centroids(source)
+    # Keep anything already learned from the geocoder (e.g. metro centroids)
+    existing = _read_table(path)
+    write_table(path, rows if existing is None else np.concatenate([rows, existing]))
+    return len(rows)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python zip_centroids.py <gazetteer.txt | zips_with_latlng.csv>")
+    print(f"Wrote {build_from_file(sys.argv[1])} centroids to {CENTROIDS_PATH}")